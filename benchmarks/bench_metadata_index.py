@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+"""
+Benchmark of path lookups in ProcessMetadata.
+
+Builds a store from synthetic exiftool records and times a full pass of
+format_tag_path over every photo, against the linear scan that was used
+before the path index.  The linear scan is timed on a sample and
+extrapolated, since a full pass is quadratic.
+
+Usage::
+
+    python benchmarks/bench_metadata_index.py [--records 50000] [--sample 100]
+"""
+
+import argparse
+import sys
+import time
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from process_metadata import ProcessMetadata
+
+
+def make_records(n, folder="/data/flight_0001"):
+    """Build ``n`` records shaped like ``exiftool -j -G -n`` output."""
+    return [{
+        "SourceFile": join(folder, "DJI_{0:05d}.JPG".format(i)),
+        "File:ImageWidth": 5472,
+        "File:ImageHeight": 3648,
+        "EXIF:FocalLength": 8.8,
+        "EXIF:GPSLatitude": 35.0 + i * 1e-5,
+        "EXIF:GPSLongitude": 137.0 + i * 1e-5,
+        "EXIF:GPSAltitude": 120.5,
+        "EXIF:Model": "FC6310",
+        "XMP:RelativeAltitude": 100.2,
+        "XMP:GimbalYawDegree": 12.3,
+        "XMP:GimbalRollDegree": 0.0,
+        "XMP:GimbalPitchDegree": -90.0,
+    } for i in range(n)]
+
+
+class LinearScan(ProcessMetadata):
+    """Lookup by path as it was done before the index."""
+
+    def load(self, metadata):
+        self.metadata = [{k.lower(): v for k, v in d.items()} for d in metadata]
+
+    def filter_tag_imgpath(self, path, tag):
+        for d in self.metadata:
+            if d['sourcefile'] == path:
+                return d.get(tag)
+        return None
+
+    def format_tag_path(self, path):
+        tags = ['file:imagewidth', 'file:imageheight', 'exif:focallength',
+                'exif:gpslatitude', 'exif:gpslongitude', 'exif:gpsaltitude',
+                'xmp:relativealtitude', 'xmp:groundaltitude', 'xmp:gimbalyawdegree',
+                'xmp:gimbalrolldegree', 'xmp:gimbalpitchdegree', 'exif:model']
+        return [self.filter_tag_imgpath(path, t) for t in tags]
+
+
+def time_pass(store, paths):
+    start = time.perf_counter()
+    for p in paths:
+        store.format_tag_path(p)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark path lookups in ProcessMetadata.")
+    parser.add_argument("--records", type=int, default=50000,
+                        help="number of synthetic records (default: 50000)")
+    parser.add_argument("--sample", type=int, default=100,
+                        help="paths timed with the linear scan (default: 100)")
+    args = parser.parse_args(argv)
+
+    records = make_records(args.records)
+    paths = [r["SourceFile"] for r in records]
+
+    start = time.perf_counter()
+    indexed = ProcessMetadata.from_metadata(records)
+    build = time.perf_counter() - start
+    full = time_pass(indexed, paths)
+
+    linear = LinearScan.from_metadata(records)
+    step = max(1, len(paths) // args.sample)
+    sample = paths[::step]
+    estimate = time_pass(linear, sample) * len(paths) / len(sample)
+
+    print("records:              {0}".format(args.records))
+    print("index build [s]:      {0:.4f}".format(build))
+    print("indexed pass [s]:     {0:.4f}".format(full))
+    print("linear pass [s]:      {0:.1f} (extrapolated from {1} paths)".format(estimate, len(sample)))
+    print("speedup:              {0:.0f}x".format(estimate / full))
+
+
+if __name__ == "__main__":
+    main()
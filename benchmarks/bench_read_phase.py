@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+"""
+Benchmark of the metadata read phase.
+
+Times the read phase of headingCalculator on a folder of photos, before
+and after the taken time was folded into the exiftool request:
+
+- legacy: exifread parses every photo for DateTimeOriginal, then
+  exiftool parses every photo again for the other tags;
+- single pass: exiftool reads all tags, taken time included;
+- fast header: the JPEG headers are parsed in Python (fast_exif), with
+  exiftool only for the photos it cannot parse.
+
+On Linux the bytes read by this process and by exiftool are taken from
+/proc/<pid>/io and reported as well.  Pages of memory mapped files are
+not counted there, so the fast header figure only covers the fallback.
+
+Usage::
+
+    python benchmarks/bench_read_phase.py FOLDER
+"""
+
+import argparse
+import sys
+import time
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from heading_calculator import getPhotos, getDateExif
+from process_metadata import ProcessMetadata
+from pyexiftool import ExifTool
+
+LEGACY_TAGS = ["exif:gpslatitude", "exif:gpslongitude", "exif:gpslatituderef",
+               "exif:gpslongituderef", "exif:gpsaltitude", "exif:model",
+               "exif:focallength", "file:imagewidth", "file:imageheight",
+               "xmp:relativealtitude", "xmp:groundaltitude",
+               "xmp:gimbalyawdegree", "xmp:gimbalrolldegree", "xmp:gimbalpitchdegree"]
+
+
+def read_chars(pid="self"):
+    """Bytes read through system calls by a process, None if unknown."""
+    try:
+        with open("/proc/{0}/io".format(pid)) as fh:
+            for line in fh:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        return None
+
+
+def run(photos, mode):
+    """Run one read phase, return (seconds, bytes read or None)."""
+    with ExifTool() as et:
+        own_before = read_chars()
+        start = time.perf_counter()
+        if mode == "legacy":
+            [getDateExif(p) for p in photos]
+            ProcessMetadata(photos, LEGACY_TAGS, et=et, fast=False)
+        else:
+            ProcessMetadata(photos, et=et, fast=(mode == "fast header")).timestamps()
+        elapsed = time.perf_counter() - start
+        own, child = read_chars(), read_chars(et._process.pid)
+    if None in (own_before, own, child):
+        return elapsed, None
+    return elapsed, own - own_before + child
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the metadata read phase.")
+    parser.add_argument("folder", help="folder of photos")
+    args = parser.parse_args(argv)
+
+    photos = getPhotos(args.folder, (".jpg", ".jpeg"))
+    print("photos: {0}".format(len(photos)))
+    for name in ("legacy", "single pass", "fast header"):
+        elapsed, nbytes = run(photos, name)
+        io = "n/a" if nbytes is None else "{0:.1f} MiB".format(nbytes / 2**20)
+        print("{0:>12}: {1:8.3f} s, read {2}".format(name, elapsed, io))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+"""
+Benchmark of the exiftool reply reader.
+
+Feeds replies of growing size through an OS pipe, the same way exiftool
+writes to the stay_open pipe, and times the legacy ``output += read()``
+loop against :py:class:`pyexiftool._ReplyReader`.
+
+Usage::
+
+    python benchmarks/bench_reply_reader.py [--max-mb 16] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import pyexiftool
+
+
+def legacy_read(fd):
+    """The reply loop used before the buffered reader was introduced."""
+    output = b""
+    while not output[-32:].strip().endswith(pyexiftool.sentinel):
+        output += os.read(fd, pyexiftool.block_size)
+    return output.strip()[:-len(pyexiftool.sentinel)]
+
+
+def make_reply(size):
+    """Build a JSON-like reply of about ``size`` bytes."""
+    record = b'{\n  "SourceFile": "DJI_0001.JPG",\n  "EXIF:GPSLatitude": 35.1234567\n},\n'
+    return record * (size // len(record) + 1)
+
+
+def time_reader(payload, read):
+    """Write ``payload`` to a pipe from a thread and time ``read`` on it."""
+    rfd, wfd = os.pipe()
+
+    def writer():
+        with os.fdopen(wfd, "wb") as fh:
+            fh.write(payload + b"\n" + pyexiftool.sentinel + b"\n")
+
+    thread = threading.Thread(target=writer)
+    with os.fdopen(rfd, "rb") as stream:
+        start = time.perf_counter()
+        thread.start()
+        reply = read(stream)
+        elapsed = time.perf_counter() - start
+    thread.join()
+    assert len(reply.strip()) == len(payload.strip())
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the exiftool reply reader.")
+    parser.add_argument("--max-mb", type=int, default=16,
+                        help="largest reply size in MiB (default: 16)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per size, the best one is kept (default: 3)")
+    args = parser.parse_args(argv)
+
+    print("{0:>10} {1:>12} {2:>12} {3:>8}".format("size", "legacy [s]", "reader [s]", "speedup"))
+    size = 64 * 1024
+    while size <= args.max_mb * 1024 * 1024:
+        payload = make_reply(size)
+        legacy = min(time_reader(payload, lambda s: legacy_read(s.fileno()))
+                     for _ in range(args.repeat))
+        reader = min(time_reader(payload, lambda s: pyexiftool._ReplyReader(s).read_reply())
+                     for _ in range(args.repeat))
+        print("{0:>9}K {1:>12.4f} {2:>12.4f} {3:>7.1f}x".format(
+            size // 1024, legacy, reader, legacy / reader))
+        size *= 2
+
+
+if __name__ == "__main__":
+    main()
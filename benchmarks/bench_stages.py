@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+"""
+Benchmark of the stages of headingCalculator on synthetic flights.
+
+Builds (once, in WORKDIR) a synthetic DJI flight of each requested size
+with make_flight.py, then times the stages of headingCalculator one by
+one on it:
+
+- discovery: getPhotos;
+- getDateExif: exifread reading the taken time of every photo, as the
+  tool did before the taken time moved into the metadata read (null
+  when exifread is not installed);
+- read exiftool / read fast: ProcessMetadata through exiftool only, and
+  with the Python JPEG header parser;
+- sort, segment, compute: ordering by taken time, splitting into
+  flights with segmentFlights, and headingCalSegments plus the photo
+  spacing, as headingCalculator runs them;
+- compute threads: the same compute on copies of the flight laid end to
+  end as separate flights, SEGMENT_PARALLEL_MIN photos or more, so the
+  flights are calculated in threads;
+- write / write sidecar: streaming the headings to exiftool, into the
+  photos and into new XMP sidecars;
+- total: headingCalculator end to end, without cache.
+
+The temporary CSV of headings is no longer a stage: headings are
+streamed to exiftool since the batch write was reworked.
+
+Each stage is timed --repeat times and the best time is kept.  The
+results are written as JSON together with the Python, platform,
+exiftool and git versions, so runs can be compared with --compare.
+
+Usage::
+
+    python benchmarks/bench_stages.py WORKDIR [--sizes 100 1000 10000] [-o results.json]
+    python benchmarks/bench_stages.py WORKDIR --compare before.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from os import cpu_count, remove
+from os.path import abspath, dirname, exists, join
+
+import numpy as np
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from heading_calculator import (HEADING_TAG, SEGMENT_JUMP, SEGMENT_PARALLEL_MIN, SEGMENT_TIME_GAP,
+                                _timeOrder, distanceCalBatch, getDateExif, getPhotos,
+                                headingCalculator, headingCalSegments, segmentFlights)
+from make_flight import make_flight
+from process_metadata import LATITUDE, LONGITUDE, ProcessMetadata
+from pyexiftool import ExifToolPool, sidecar_path
+
+SIZES = (100, 1000, 10000)
+STAGES = ("discovery", "getDateExif", "read exiftool", "read fast", "sort", "segment", "compute",
+          "compute threads", "write", "write sidecar", "total")
+
+
+def best_of(repeat, func, setup=None):
+    """Best wall time of func over repeat runs, in seconds."""
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def has_exifread():
+    try:
+        import exifread
+    except ImportError:
+        return False
+    return True
+
+
+def time_stages(folder, et, repeat=1):
+    """Time each stage on the photos of folder, return {stage: seconds}."""
+    times = dict()
+    ext = (".jpg",)
+    photos = getPhotos(folder, ext)
+
+    times["discovery"] = best_of(repeat, lambda: getPhotos(folder, ext))
+    if has_exifread():
+        times["getDateExif"] = best_of(repeat, lambda: [getDateExif(p) for p in photos])
+    else:
+        times["getDateExif"] = None
+    times["read exiftool"] = best_of(repeat, lambda: ProcessMetadata(photos, et=et, fast=False))
+    times["read fast"] = best_of(repeat, lambda: ProcessMetadata(photos, et=et))
+
+    proobj = ProcessMetadata(photos, et=et)
+    timestamps = proobj.timestamps()
+    files = list(proobj.column("sourcefile"))
+    table = proobj.table
+    times["sort"] = best_of(repeat, lambda: proobj.sort(_timeOrder(timestamps, files)),
+                            lambda: proobj.set_table(table))
+    timestamps = timestamps[_timeOrder(timestamps, files)]
+
+    lon, lat = proobj.column(LONGITUDE), proobj.column(LATITUDE)
+    times["segment"] = best_of(
+        repeat, lambda: segmentFlights(timestamps, lon, lat, SEGMENT_TIME_GAP, SEGMENT_JUMP))
+    segments = segmentFlights(timestamps, lon, lat, SEGMENT_TIME_GAP, SEGMENT_JUMP)
+    times["compute"] = best_of(repeat, lambda: (headingCalSegments(lon, lat, segments),
+                                                distanceCalBatch(lon, lat)))
+    headings = headingCalSegments(lon, lat, segments)
+    values = [[f, float(h)] for f, h in zip(list(proobj.column("sourcefile"))[1:-1], headings)
+              if np.isfinite(h)]
+
+    # copies of the flight, each one a flight of its own
+    copies = max(2, -(-SEGMENT_PARALLEL_MIN // len(lon)))
+    span = timestamps[-1] - timestamps[0] + 2 * SEGMENT_TIME_GAP
+    tiled_time = np.concatenate([timestamps + i * span for i in range(copies)])
+    tiled_lon, tiled_lat = np.tile(lon, copies), np.tile(lat, copies)
+    tiled = segmentFlights(tiled_time, tiled_lon, tiled_lat, SEGMENT_TIME_GAP, SEGMENT_JUMP)
+    times["compute threads"] = best_of(repeat, lambda: (headingCalSegments(tiled_lon, tiled_lat, tiled),
+                                                        distanceCalBatch(tiled_lon, tiled_lat)))
+
+    def remove_sidecars():
+        for f, _ in values:
+            if exists(sidecar_path(f)):
+                remove(sidecar_path(f))
+
+    times["write"] = best_of(repeat, lambda: list(et.iter_write_tag_batch(HEADING_TAG, values)))
+    times["write sidecar"] = best_of(
+        repeat, lambda: list(et.iter_write_tag_batch(HEADING_TAG, values, sidecar=True)), remove_sidecars)
+    remove_sidecars()
+    times["total"] = best_of(repeat, lambda: headingCalculator(folder, ext, et=et))
+    return times
+
+
+def environment(et):
+    """Versions of the software the benchmark ran with."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                         cwd=dirname(abspath(__file__)),
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": cpu_count(),
+            "exiftool": et.execute(b"-ver").decode().strip(),
+            "exiftool processes": et.size,
+            "commit": commit}
+
+
+def compare(old, new):
+    """Print the times of new against those of old, as ratios."""
+    print("{0:>8} {1:>15} {2:>10} {3:>10} {4:>7}".format("photos", "stage", "before", "after", "ratio"))
+    for size, times in sorted(new["results"].items(), key=lambda kv: int(kv[0])):
+        before = old["results"].get(size, {})
+        for stage in STAGES:
+            a, b = before.get(stage), times.get(stage)
+            if a is None or b is None:
+                continue
+            print("{0:>8} {1:>15} {2:10.3f} {3:10.3f} {4:7.2f}".format(size, stage, a, b, b / a if a else float("nan")))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stages of headingCalculator.")
+    parser.add_argument("workdir", help="folder holding the synthetic flights")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES),
+                        help="number of photos of each flight (default: 100 1000 10000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best is kept (default: 3)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of exiftool processes (default: number of CPUs)")
+    parser.add_argument("-o", "--output", help="JSON file for the results (default: WORKDIR/bench_<date>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="earlier results to compare with")
+    args = parser.parse_args(argv)
+
+    et = ExifToolPool(args.workers)
+    et.start()
+    try:
+        report = {"environment": environment(et), "results": dict()}
+        for size in args.sizes:
+            folder = join(args.workdir, "flight_{0}".format(size))
+            make_flight(folder, size, et)
+            times = time_stages(folder, et, args.repeat)
+            report["results"][str(size)] = times
+            print("{0} photos".format(size))
+            for stage in STAGES:
+                t = times[stage]
+                print("  {0:>15}: {1}".format(stage, "n/a" if t is None else "{0:8.3f} s".format(t)))
+    finally:
+        et.terminate()
+
+    output = args.output or join(args.workdir, "bench_{0}.json".format(
+        datetime.now().strftime("%Y%m%d_%H%M%S")))
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("results: {0}".format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
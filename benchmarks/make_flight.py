@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+"""
+Synthetic drone flights for the benchmarks.
+
+Builds a folder of small JPEG photos tagged like the photos of a DJI
+survey flight: a lawnmower track of parallel lines flown at constant
+speed and altitude, one photo every two seconds, with the GPS position,
+altitude, camera model, focal length and taken time in EXIF and the
+relative altitude and gimbal angles in the drone-dji XMP namespace.
+
+The photos are copies of one 16x16 JPEG; all tags of a flight are then
+written by the bundled exiftool in a single -csv= command.
+
+Usage::
+
+    python benchmarks/make_flight.py FOLDER [--photos 1000]
+"""
+
+import argparse
+import base64
+import csv
+import sys
+from math import cos, degrees, radians
+from os import close, makedirs, remove
+from os.path import abspath, dirname, join
+from tempfile import mkstemp
+from time import gmtime, strftime
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from heading_calculator import getPhotos
+from pyexiftool import ExifTool, fsencode, update_counts
+
+# 16x16 grey baseline JPEG
+TEMPLATE_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9PDkz"
+    "ODdASFxOQERXRTc4UG1RV19iZ2hnPk1xeXBkeFxlZ2P/wAALCAAQABABAREA/8QAHwAAAQUBAQEB"
+    "AQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1Fh"
+    "ByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZ"
+    "WmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXG"
+    "x8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/9oACAEBAAA/ACiiiv/Z")
+
+# flight parameters
+ORIGIN = (35.1000, 137.0000)    # latitude, longitude of the first photo
+ALTITUDE = 100.0                # m above take-off
+GROUND = 52.0                   # m above sea level at take-off
+SPEED = 10.0                    # m/s
+INTERVAL = 2.0                  # s between photos
+LINE_PHOTOS = 50                # photos per flight line
+LINE_SPACING = 40.0             # m between flight lines
+START = 1598918400              # 2020-09-01 00:00:00 UTC
+EARTH_RADIUS = 6378137.0
+
+COLUMNS = ["SourceFile", "EXIF:GPSLatitude", "EXIF:GPSLatitudeRef", "EXIF:GPSLongitude",
+           "EXIF:GPSLongitudeRef", "EXIF:GPSAltitude", "EXIF:GPSAltitudeRef", "EXIF:Model",
+           "EXIF:FocalLength", "EXIF:DateTimeOriginal", "EXIF:SubSecTimeOriginal",
+           "XMP-drone-dji:RelativeAltitude", "XMP-drone-dji:GimbalYawDegree",
+           "XMP-drone-dji:GimbalRollDegree", "XMP-drone-dji:GimbalPitchDegree"]
+
+
+def track(n):
+    """
+    Positions and flight directions of n photos of a lawnmower flight.
+
+    Returns
+    -------
+    list
+        (latitude, longitude, yaw in degrees) of each photo.
+    """
+
+    lat0, lon0 = ORIGIN
+    step = SPEED * INTERVAL
+    points = list()
+    for i in range(n):
+        line, k = divmod(i, LINE_PHOTOS)
+        # odd lines are flown back south
+        north = k * step if line % 2 == 0 else (LINE_PHOTOS - 1 - k) * step
+        east = line * LINE_SPACING
+        lat = lat0 + degrees(north / EARTH_RADIUS)
+        lon = lon0 + degrees(east / (EARTH_RADIUS * cos(radians(lat0))))
+        points.append((lat, lon, 0.0 if line % 2 == 0 else 180.0))
+    return points
+
+
+def write_csv(path, photos):
+    """
+    Write the exiftool CSV holding the tags of the photos, in flight order.
+    """
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for i, (photo, (lat, lon, yaw)) in enumerate(zip(photos, track(len(photos)))):
+            t = START + i * INTERVAL
+            seconds = int(t)
+            stamp = strftime("%Y:%m:%d %H:%M:%S", gmtime(seconds))
+            writer.writerow([photo, "{0:.8f}".format(lat), "N", "{0:.8f}".format(lon), "E",
+                             "{0:.3f}".format(GROUND + ALTITUDE), 0, "FC6310", 8.8, stamp,
+                             "{0:03d}".format(int((t - seconds) * 1000)),
+                             "+{0:.2f}".format(ALTITUDE), "{0:.2f}".format(yaw),
+                             "+0.00", "-90.00"])
+
+
+def make_flight(folder, n, et=None):
+    """
+    Build a flight of n photos in folder, unless it is already there.
+
+    Parameters
+    ----------
+    folder : string
+        Output folder, created if needed.
+    n : int
+        Number of photos.
+    et : ExifTool, optional
+        Running exiftool used to write the tags. The default is None,
+        which starts one.
+
+    Returns
+    -------
+    list
+        Full paths to the photos.
+    """
+
+    makedirs(folder, exist_ok=True)
+    photos = sorted(getPhotos(folder, (".jpg",)))
+    if len(photos) == n:
+        return photos
+
+    photos = [join(folder, "DJI_{0:06d}.JPG".format(i + 1)) for i in range(n)]
+    for photo in photos:
+        with open(photo, "wb") as f:
+            f.write(TEMPLATE_JPEG)
+    # the CSV is kept out of the flight, where a run over .csv files would find it
+    fd, csvname = mkstemp(suffix=".csv")
+    close(fd)
+    try:
+        write_csv(csvname, photos)
+        own_et = et is None
+        if own_et:
+            et = ExifTool()
+            et.start()
+        try:
+            reply = et.execute(b"-overwrite_original", fsencode("-csv=" + csvname), fsencode(folder))
+        finally:
+            if own_et:
+                et.terminate()
+    finally:
+        remove(csvname)
+    updated, unchanged, failed = update_counts(reply)
+    if updated != n:
+        raise Exception("exiftool tagged {0} of {1} photos: {2}".format(
+            updated, n, et.last_errors.decode("utf-8", "replace").strip()))
+    return photos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a synthetic DJI flight.")
+    parser.add_argument("folder", help="output folder")
+    parser.add_argument("--photos", type=int, default=1000, help="number of photos (default: 1000)")
+    args = parser.parse_args(argv)
+
+    photos = make_flight(args.folder, args.photos)
+    print("{0}: {1} photos".format(args.folder, len(photos)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+"""
+Headless command line interface of Heading Calculator.
+
+Runs the same pipeline as the desktop application, without importing
+PyQt5, on one or more folders:
+
+    python -m heading_calculator FOLDER [FOLDER ...] [-w WORKERS] [-f {text,csv,json}]
+"""
+
+import argparse
+import csv
+import json
+import sys
+from os.path import basename
+
+from heading_calculator import headingCalculator, HEADING_TOLERANCE, SEGMENT_JUMP, SEGMENT_TIME_GAP
+from job_control import Callback, formatStats
+from metadata_cache import MetadataCache
+from pyexiftool import ExifToolPool
+from profiling import profiled
+
+
+class ConsoleProgress:
+    """
+    Progress callback that draws the phase and percentage on a terminal.
+    """
+
+    def __init__(self, folder, stream=sys.stderr):
+        self.folder = folder
+        self.stream = stream
+        self.last = -1
+        self.phase = ""
+        self.phases = Callback(self.setPhase)
+
+    def setPhase(self, name):
+        self.phase = name
+
+    def emit(self, percent):
+        # updates arrive throttled by the ProgressReporter of the job
+        self.last = int(percent)
+        self.stream.write("\r{0}: {1:3d}% {2:<8}".format(basename(self.folder) or self.folder,
+                                                         self.last, self.phase))
+        self.stream.flush()
+
+    def done(self):
+        if self.last >= 0:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+def build_parser():
+    """
+    Build the argument parser of the command line interface.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="python -m heading_calculator",
+        description="Estimate camera heading angles for drone photos and write them "
+                    "to the FlightYawDegree tag.")
+    parser.add_argument("folders", nargs="+", metavar="FOLDER",
+                        help="folder containing the photos of a flight")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of exiftool processes (default: number of CPUs, at most 8)")
+    parser.add_argument("-p", "--processes", type=int, default=0,
+                        help="number of processes parsing photo headers, 1 to parse them in the "
+                             "main process (default: 0, all CPUs for large folders)")
+    parser.add_argument("-f", "--format", choices=("text", "csv", "json"), default="text",
+                        help="output format (default: text)")
+    parser.add_argument("-o", "--output", default="-",
+                        help="output file (default: standard output)")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="also process the photos in subfolders of each folder")
+    parser.add_argument("-e", "--ext", action="append", default=None,
+                        help="photo extension, may be repeated (default: .jpg)")
+    parser.add_argument("--sidecar", action="store_true",
+                        help="write headings to .xmp sidecar files instead of rewriting the photos")
+    parser.add_argument("--skip-unchanged", action="store_true",
+                        help="only write photos whose heading differs from the one already written")
+    parser.add_argument("--tolerance", type=float, default=HEADING_TOLERANCE,
+                        help="largest heading change in degrees treated as unchanged "
+                             "(default: {0})".format(HEADING_TOLERANCE))
+    parser.add_argument("--max-gap", type=float, default=SEGMENT_TIME_GAP, metavar="SECONDS",
+                        help="photos taken further apart belong to different flights, 0 to not split "
+                             "on time (default: {0:g})".format(SEGMENT_TIME_GAP))
+    parser.add_argument("--max-jump", type=float, default=SEGMENT_JUMP, metavar="FACTOR",
+                        help="photos further apart than FACTOR times the median photo spacing belong to "
+                             "different flights, 0 to not split on distance (default: {0:g})".format(SEGMENT_JUMP))
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="keep a state file per folder and, on reruns, only read the new photos and "
+                             "write them and their neighbours")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="read all photos instead of reusing cached metadata")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="do not show progress")
+    parser.add_argument("--stats", action="store_true",
+                        help="print the time, files and exiftool traffic of each phase to standard "
+                             "error (and add them to the json output)")
+    parser.add_argument("--profile", metavar="DIR", default=None,
+                        help="profile each folder with cProfile, writing a .prof file per folder to DIR")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="with --profile, also trace memory allocations and write the lines "
+                             "holding the most memory to a .alloc.txt file")
+    return parser
+
+
+def write_results(results, fmt, stream, stats=False):
+    """
+    Write the results of all folders.
+
+    Parameters
+    ----------
+    results : list
+        (folder, result dict of headingCalculator) for each processed folder.
+    fmt : string
+        One of 'text', 'csv' and 'json'.
+    stream : file
+        Output stream.
+    stats : bool, optional
+        Add the stats of each folder to the json output.
+
+    """
+
+    if fmt == "text":
+        for folder, result in results:
+            stream.write("{0}\n{1}\n".format(folder, result["msg"]))
+    elif fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(["Folder", "SourceFile", "FlightYawDegree", "Longitude", "Latitude"])
+        for folder, result in results:
+            for r in result["heading"]:
+                writer.writerow([folder] + list(r))
+    else:
+        output = list()
+        for folder, result in results:
+            output.append({"folder": folder,
+                           "avgdist": result["avgdist"],
+                           "segments": result["segments"],
+                           "photos": [{"file": r[0], "heading": r[1], "longitude": r[2], "latitude": r[3]}
+                                      for r in result["heading"]]})
+            if stats:
+                output[-1]["stats"] = result["stats"]
+        json.dump(output, stream, indent=2)
+        stream.write("\n")
+
+
+def main(argv=None):
+    """
+    Run the command line interface, return the exit status.
+    """
+
+    args = build_parser().parse_args(argv)
+    exts = tuple(e.lower() if e.startswith(".") else "." + e.lower() for e in (args.ext or [".jpg"]))
+
+    run = headingCalculator
+    if args.profile:
+        run = profiled(headingCalculator, args.profile, args.profile_memory)
+
+    results = list()
+    failed = 0
+    cache = None if args.no_cache else MetadataCache()
+    try:
+        with ExifToolPool(args.workers) as et:
+            for folder in args.folders:
+                progress = None if args.quiet else ConsoleProgress(folder)
+                try:
+                    result = run(folder, exts, progress, et=et, cache=cache,
+                                 phase_callback=progress and progress.phases,
+                                 sidecar=args.sidecar, skip_unchanged=args.skip_unchanged,
+                                 tolerance=args.tolerance, processes=args.processes,
+                                 recursive=args.recursive, max_gap=args.max_gap or None,
+                                 max_jump=args.max_jump or None, incremental=args.incremental)
+                    results.append((folder, result))
+                    if args.profile:
+                        sys.stderr.write("{0}: profile written to {1}\n".format(folder, ", ".join(result["profile"])))
+                    if args.stats:
+                        if progress is not None:
+                            progress.done()
+                            progress = None
+                        sys.stderr.write("{0}\n{1}\n".format(folder, formatStats(result["stats"])))
+                    if result["failed"]:
+                        failed += 1
+                        for path, error in result["failed"].items():
+                            sys.stderr.write("{0}: {1}\n".format(path, error))
+                    for path in result["untimed"]:
+                        sys.stderr.write("{0}: no taken time, heading not calculated\n".format(path))
+                except Exception as e:
+                    failed += 1
+                    sys.stderr.write("{0}: {1}\n".format(folder, e))
+                finally:
+                    if progress is not None:
+                        progress.done()
+    except KeyboardInterrupt:
+        # the pool restarts or stops its exiftool processes on the way out
+        sys.stderr.write("Interrupted\n")
+        return 130
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if args.output == "-":
+        write_results(results, args.format, sys.stdout, args.stats)
+    else:
+        with open(args.output, "w", newline="") as f:
+            write_results(results, args.format, f, args.stats)
+
+    return 1 if failed else 0
@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+"""
+Fast reader of the metadata fields used for heading calculation.
+
+Parses only the header segments of a JPEG photo: the image size from the
+start of frame, the GPS, camera model, focal length and taken time from
+the EXIF APP1 segment, and the DJI attributes (altitudes, gimbal and
+flight yaw) from the XMP APP1 segment.  The file is memory mapped, so
+only the pages of the header are read from disk, however large the photo.
+
+Records have the format of exiftool -j -G -n output, so they can be
+mixed with records read by exiftool.  Photos the reader cannot parse
+(other formats, damaged headers), and requests for tags it does not
+know, go to exiftool.
+"""
+
+import mmap
+import re
+from collections import deque
+from itertools import chain, islice
+from multiprocessing import get_context
+from os import cpu_count
+from struct import unpack_from, error as StructError
+from threading import Lock
+
+from pyexiftool import max_pool_size
+
+
+# photos per work unit of a worker process, and smallest batch worth the processes
+CHUNK_SIZE = 256
+PARALLEL_MIN_FILES = 2000
+
+# worker processes shared by all readers of this process, see _worker_pool
+_pool = None
+_pool_lock = Lock()
+
+
+# JPEG markers
+SOI = 0xD8
+SOS = 0xDA
+EOI = 0xD9
+APP1 = 0xE1
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+EXIF_HEADER = b'Exif\x00\x00'
+XMP_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+
+# TIFF tags of IFD0, the EXIF IFD and the GPS IFD
+TAG_MODEL = 0x0110
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_DATETIMEORIGINAL = 0x9003
+TAG_SUBSECTIMEORIGINAL = 0x9291
+TAG_FOCALLENGTH = 0x920A
+
+# exiftool name of the GPS tags read
+GPS_TAGS = {1: 'EXIF:GPSLatitudeRef', 2: 'EXIF:GPSLatitude', 3: 'EXIF:GPSLongitudeRef',
+            4: 'EXIF:GPSLongitude', 5: 'EXIF:GPSAltitudeRef', 6: 'EXIF:GPSAltitude'}
+
+# DJI XMP properties read, as attributes (camera) or elements (written by exiftool)
+XMP_TAGS = ('RelativeAltitude', 'GroundAltitude', 'GimbalYawDegree', 'GimbalRollDegree',
+            'GimbalPitchDegree', 'FlightYawDegree')
+XMP_PATTERN = re.compile(rb'(?<=[<\s])[\w-]+:(' + b'|'.join(t.encode() for t in XMP_TAGS) +
+                         rb')(?:\s*=\s*"([^"]*)"|>([^<]*)<)')
+
+# size in bytes of each TIFF field type
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+# field name of each lowercased tag this reader extracts; other tags need exiftool
+FIELD_NAMES = {name.lower(): name for name in
+               ['File:ImageWidth', 'File:ImageHeight', 'EXIF:Model', 'EXIF:FocalLength',
+                'EXIF:DateTimeOriginal', 'EXIF:SubSecTimeOriginal'] +
+               list(GPS_TAGS.values()) + ['XMP:' + t for t in XMP_TAGS]}
+FAST_TAGS = set(FIELD_NAMES)
+
+
+def supports(tags):
+    """
+    Check whether all tags can be read by this module.
+
+    Parameters
+    ----------
+    tags : list
+        Tags as given to exiftool, e.g. 'exif:gpslatitude'.
+
+    Returns
+    -------
+    bool
+
+    """
+
+    return all(t.lower() in FAST_TAGS for t in tags)
+
+
+def _ifd_value(buf, base, fmt, entry):
+    """
+    Decode the value of an IFD entry, None for unsupported types.
+    """
+
+    typ, count = unpack_from(fmt + 'HI', buf, entry + 2)
+    size = TYPE_SIZES.get(typ)
+    if size is None:
+        return None
+    # values of up to 4 bytes are stored in the entry itself
+    offset = entry + 8 if size * count <= 4 else base + unpack_from(fmt + 'I', buf, entry + 8)[0]
+
+    if typ == 2:
+        raw = bytes(buf[offset:offset + count])
+        return raw.split(b'\x00', 1)[0].decode('utf-8', 'replace').strip()
+    if typ in (5, 10):
+        code = 'I' if typ == 5 else 'i'
+        values = list()
+        for k in range(count):
+            num, den = unpack_from(fmt + code * 2, buf, offset + 8 * k)
+            values.append(num / den if den else float('nan'))
+        return values
+    code = {1: 'B', 3: 'H', 4: 'I', 6: 'b', 7: 'B', 8: 'h', 9: 'i', 11: 'f', 12: 'd'}[typ]
+    values = list(unpack_from(fmt + code * count, buf, offset))
+    return values
+
+
+def _ifd(buf, base, fmt, offset):
+    """
+    Map tag -> entry position of the IFD at offset from the TIFF header.
+    """
+
+    start = base + offset
+    count = unpack_from(fmt + 'H', buf, start)[0]
+    return {unpack_from(fmt + 'H', buf, start + 2 + 12 * k)[0]: start + 2 + 12 * k for k in range(count)}
+
+
+def _first(value):
+
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def _parse_exif(buf, base, record):
+    """
+    Add the fields of the TIFF structure starting at base to record.
+    """
+
+    order = bytes(buf[base:base + 2])
+    if order == b'II':
+        fmt = '<'
+    elif order == b'MM':
+        fmt = '>'
+    else:
+        raise ValueError('Invalid TIFF header')
+
+    ifd0 = _ifd(buf, base, fmt, unpack_from(fmt + 'I', buf, base + 4)[0])
+    if TAG_MODEL in ifd0:
+        record['EXIF:Model'] = _ifd_value(buf, base, fmt, ifd0[TAG_MODEL])
+
+    if TAG_EXIF_IFD in ifd0:
+        exif = _ifd(buf, base, fmt, _first(_ifd_value(buf, base, fmt, ifd0[TAG_EXIF_IFD])))
+        if TAG_DATETIMEORIGINAL in exif:
+            record['EXIF:DateTimeOriginal'] = _ifd_value(buf, base, fmt, exif[TAG_DATETIMEORIGINAL])
+        if TAG_SUBSECTIMEORIGINAL in exif:
+            record['EXIF:SubSecTimeOriginal'] = _ifd_value(buf, base, fmt, exif[TAG_SUBSECTIMEORIGINAL])
+        if TAG_FOCALLENGTH in exif:
+            record['EXIF:FocalLength'] = _first(_ifd_value(buf, base, fmt, exif[TAG_FOCALLENGTH]))
+
+    if TAG_GPS_IFD in ifd0:
+        gps = _ifd(buf, base, fmt, _first(_ifd_value(buf, base, fmt, ifd0[TAG_GPS_IFD])))
+        for tag, name in GPS_TAGS.items():
+            if tag not in gps:
+                continue
+            value = _ifd_value(buf, base, fmt, gps[tag])
+            if tag in (2, 4):
+                # degrees, minutes, seconds to decimal degrees, as exiftool -n
+                value = value[0] + value[1] / 60 + value[2] / 3600
+            else:
+                value = _first(value)
+            record[name] = value
+
+
+def _parse_xmp(packet, record):
+    """
+    Add the DJI properties of an XMP packet to record.
+    """
+
+    for m in XMP_PATTERN.finditer(packet):
+        value = (m.group(2) if m.group(2) is not None else m.group(3)).decode('utf-8', 'replace').strip()
+        try:
+            record['XMP:' + m.group(1).decode()] = float(value)
+        except ValueError:
+            record['XMP:' + m.group(1).decode()] = value
+
+
+def parse_jpeg(buf):
+    """
+    Parse the header segments of a JPEG image.
+
+    Parameters
+    ----------
+    buf : buffer
+        Content of the file, e.g. a memory map.
+
+    Raises
+    ------
+    ValueError
+        Not a JPEG image, or a damaged header.
+
+    Returns
+    -------
+    dict
+        Fields found, named as in exiftool -G -n output.
+
+    """
+
+    if len(buf) < 4 or buf[0] != 0xFF or buf[1] != SOI:
+        raise ValueError('Not a JPEG image')
+
+    record = dict()
+    pos = 2
+    end = len(buf)
+    try:
+        while pos + 4 <= end:
+            if buf[pos] != 0xFF:
+                raise ValueError('Invalid JPEG marker')
+            marker = buf[pos + 1]
+            if marker == 0xFF:
+                # fill byte
+                pos += 1
+                continue
+            if marker == SOS or marker == EOI:
+                break
+            length = unpack_from('>H', buf, pos + 2)[0]
+            data = pos + 4
+            if marker == APP1:
+                if buf[data:data + 6] == EXIF_HEADER:
+                    _parse_exif(buf, data + 6, record)
+                elif buf[data:data + len(XMP_HEADER)] == XMP_HEADER:
+                    _parse_xmp(bytes(buf[data + len(XMP_HEADER):pos + 2 + length]), record)
+            elif marker in SOF_MARKERS:
+                height, width = unpack_from('>HH', buf, data + 1)
+                record['File:ImageWidth'] = width
+                record['File:ImageHeight'] = height
+                # image data follows, all APP segments come before it
+                break
+            pos += 2 + length
+    except (StructError, IndexError, KeyError, TypeError) as e:
+        raise ValueError('Damaged JPEG header: {0}'.format(e))
+    return record
+
+
+def field_names(tags):
+    """
+    Names of the fields of the requested tags, as in exiftool -G output.
+
+    Parameters
+    ----------
+    tags : list
+        Tags to read, all supported (see supports).
+
+    Returns
+    -------
+    tuple
+        Field names, e.g. 'EXIF:GPSLatitude' for 'exif:gpslatitude'.
+
+    """
+
+    return tuple(FIELD_NAMES[t.lower()] for t in tags)
+
+
+def read_row(path, fields):
+    """
+    Read fields of a photo without exiftool.
+
+    Parameters
+    ----------
+    path : string
+        Full path to the photo.
+    fields : tuple
+        Field names, see field_names.
+
+    Returns
+    -------
+    tuple or None
+        Value of each field, None where the photo does not have it.
+        None if the photo is not a JPEG image or cannot be parsed.
+
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                found = parse_jpeg(buf)
+    except (OSError, ValueError):
+        return None
+    return tuple(found.get(name) for name in fields)
+
+
+def make_record(path, fields, row):
+    """
+    Build the exiftool-style record of a photo from a row of read_row.
+    """
+
+    record = {'SourceFile': path}
+    for name, value in zip(fields, row):
+        if value is not None:
+            record[name] = value
+    return record
+
+
+def read_tags(path, tags):
+    """
+    Read tags of a photo without exiftool.
+
+    Parameters
+    ----------
+    path : string
+        Full path to the photo.
+    tags : list
+        Tags to read, all supported (see supports).
+
+    Returns
+    -------
+    dict or None
+        Record in the format of exiftool -j -G -n output, holding the
+        requested tags found in the photo.  None if the photo is not a
+        JPEG image or cannot be parsed.
+
+    """
+
+    fields = field_names(tags)
+    row = read_row(path, fields)
+    if row is None:
+        return None
+    return make_record(path, fields, row)
+
+
+def read_chunk(fields, paths):
+    """
+    Read a chunk of photos in a worker process.
+
+    Rows are returned as tuples, which are much cheaper to send back to
+    the main process than dictionaries.
+    """
+
+    return [read_row(p, fields) for p in paths]
+
+
+def _worker_pool(processes):
+    """
+    Return the worker processes shared by all readers, started on first use.
+
+    Jobs running in parallel share one pool of at most max_pool_size
+    processes, sized by the first reader that needs it.  The workers are
+    spawned rather than forked, as readers may run on a Qt thread.
+    """
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = get_context('spawn').Pool(min(processes, max_pool_size))
+        return _pool
+
+
+def _iter_rows(fields, filenames, processes):
+    """
+    Yield (path, row) of each photo in the order of filenames.
+
+    filenames may be a generator, e.g. a directory walk still running:
+    chunks are submitted to the workers as soon as they are complete.
+    """
+
+    filenames = iter(filenames)
+    head = list()
+    if processes is None or processes == 0:
+        # find out whether the batch is large enough to be worth the processes
+        head = list(islice(filenames, PARALLEL_MIN_FILES))
+        processes = (cpu_count() or 1) if len(head) == PARALLEL_MIN_FILES else 1
+    filenames = chain(head, filenames)
+    if processes <= 1:
+        for path in filenames:
+            yield path, read_row(path, fields)
+        return
+
+    processes = min(processes, max_pool_size)
+    pool = _worker_pool(processes)
+    pending = deque()
+    while True:
+        # keep every worker busy, with a chunk waiting for each; a closed
+        # stream leaves at most these chunks to finish in the pool
+        while len(pending) < 2 * processes:
+            paths = list(islice(filenames, CHUNK_SIZE))
+            if not paths:
+                break
+            pending.append((paths, pool.apply_async(read_chunk, (fields, paths))))
+        if not pending:
+            return
+        # chunks are taken in submission order, whichever worker finishes first
+        paths, result = pending.popleft()
+        for item in zip(paths, result.get()):
+            yield item
+
+
+def iter_tags_batch(tags, filenames, et=None, processes=None):
+    """
+    Stream records of photos, read by this module where possible.
+
+    Parameters
+    ----------
+    tags : list
+        Tags to read.
+    filenames : iterable
+        Full paths to the photos, may be a generator.
+    et : ExifTool or ExifToolPool, optional
+        Running exiftool instance reading the photos this module cannot
+        parse, and all photos if some tag is not supported.
+        The default is None, which skips those photos.
+    processes : int, optional
+        Number of worker processes parsing chunks of CHUNK_SIZE photos,
+        at most max_pool_size; 1 parses in this process.  The default is
+        None (or 0), which uses all CPUs for PARALLEL_MIN_FILES photos or
+        more.  The workers are shared by all calls, see _worker_pool.
+
+    Returns
+    -------
+    generator
+        Records in the format of exiftool -j -G -n output.  Records read
+        by this module come first, in the order of filenames, followed
+        by the records read by exiftool.
+
+    """
+
+    if not supports(tags):
+        if et is not None:
+            for d in et.iter_tags_batch(tags, filenames):
+                yield d
+        return
+
+    fields = field_names(tags)
+    fallback = list()
+    for path, row in _iter_rows(fields, filenames, processes):
+        if row is None:
+            fallback.append(path)
+        else:
+            yield make_record(path, fields, row)
+
+    if fallback and et is not None:
+        for d in et.iter_tags_batch(tags, fallback):
+            yield d
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+import hashlib
+import json
+from os import access, makedirs, remove, replace, W_OK
+from os.path import abspath, dirname, exists, join, relpath
+
+from metadata_cache import default_cache_path
+
+
+# name of the state file kept in each processed folder
+STATE_NAME = '.heading_calculator.json'
+
+# version of the state file layout, states of other versions are ignored
+STATE_VERSION = 1
+
+# fields of each photo of the timeline, in the order they are stored
+COLUMNS = ('file', 'size', 'mtime_ns', 'time', 'lon', 'lat', 'start', 'heading', 'written')
+
+
+def fallback_state_path(folder):
+    """
+    Location of the state of a folder that cannot hold it, e.g. a read-only share.
+
+    Returns
+    -------
+    string
+        state/<hash of the folder path>.json next to the metadata cache.
+
+    """
+
+    key = hashlib.sha1(abspath(str(folder)).encode('utf-8')).hexdigest()[:16]
+    return join(dirname(default_cache_path()), 'state', key + '.json')
+
+
+def _number(value):
+
+    # NaN is not valid JSON
+    return None if value is None or value != value else float(value)
+
+
+class FolderState:
+    """
+    Timeline of a folder from the last incremental run.
+
+    The state holds the photos of the folder sorted by taken time, with
+    the size and modification time they had after the run, their time
+    and position, whether they start a flight, the heading calculated
+    for them and whether it was written.  It is stored as JSON in the
+    folder (STATE_NAME), or next to the metadata cache when the folder
+    is not writable.  A state saved with other settings (extensions,
+    subfolders, sidecars, flight splitting) is ignored.
+    """
+
+    def __init__(self, folder, settings):
+
+        self.folder = str(folder)
+        self.settings = settings
+        self.entries = list()
+
+    def paths(self):
+        """
+        Candidate locations of the state file, the folder first.
+        """
+
+        return [join(self.folder, STATE_NAME), fallback_state_path(self.folder)]
+
+    def load(self):
+        """
+        Read the state of the folder.
+
+        Returns
+        -------
+        bool
+            True if a state with the same settings was found; otherwise the
+            timeline is empty.
+
+        """
+
+        self.entries = list()
+        for path in self.paths():
+            if not exists(path):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data.get('version') != STATE_VERSION or data.get('settings') != self.settings \
+                    or data.get('columns') != list(COLUMNS):
+                continue
+            for row in data['photos']:
+                entry = dict(zip(COLUMNS, row))
+                entry['file'] = join(self.folder, entry['file'])
+                for key in ('time', 'lon', 'lat', 'heading'):
+                    if entry[key] is None:
+                        entry[key] = float('nan')
+                self.entries.append(entry)
+            return True
+        return False
+
+    def save(self, entries):
+        """
+        Write the timeline, a list of dicts with the fields of COLUMNS.
+
+        The file is replaced atomically; a folder that cannot be written
+        falls back to the cache location, and a stale copy there is removed
+        once the folder accepts the state.  Return the path written.
+        """
+
+        self.entries = entries
+        data = {'version': STATE_VERSION, 'settings': self.settings, 'columns': list(COLUMNS),
+                'photos': [[relpath(e['file'], self.folder), e['size'], e['mtime_ns'], _number(e['time']),
+                            _number(e['lon']), _number(e['lat']), bool(e['start']), _number(e['heading']),
+                            bool(e['written'])] for e in entries]}
+        text = json.dumps(data, separators=(',', ':'))
+        inside, fallback = self.paths()
+        for path in (inside, fallback):
+            if path == inside and not access(self.folder, W_OK):
+                continue
+            try:
+                makedirs(dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    f.write(text)
+                replace(path + '.tmp', path)
+            except OSError:
+                continue
+            if path == inside and exists(fallback):
+                try:
+                    remove(fallback)
+                except OSError:
+                    pass
+            return path
+        raise Exception('Cannot save the state of folder: {0}'.format(self.folder))
@@ -22,18 +22,97 @@
  ***************************************************************************/
 """
 
-import csv
-from math import atan2, sqrt
-from os import listdir
-from os.path import basename, join, isfile, exists
+from math import atan2, sqrt, isfinite
+from concurrent.futures import ThreadPoolExecutor
+from os import scandir, stat
+from os.path import basename, exists
 from datetime import datetime
-import exifread
+import numpy as np
 
 from process_metadata import *
-from pyexiftool import ExifTool
+from pyexiftool import ExifToolPool, WriteResult, sidecar_path
+from job_control import CancelToken, JobStats, ProgressReporter, checked
+from folder_state import FolderState
 
 
-def getPhotos(folder, exts=('.jpg')):
+# tag receiving the calculated heading
+HEADING_TAG = "XMP:FlightYawDegree"
+
+# headings closer than this (degrees) to the value already written are not rewritten
+HEADING_TOLERANCE = 0.01
+
+# photos taken more than this many seconds apart belong to different flights
+SEGMENT_TIME_GAP = 120.0
+
+# photos farther apart than this many times the median photo spacing belong to different flights
+SEGMENT_JUMP = 10.0
+
+# flights are calculated in parallel from this many photos, below threads cost more than they save
+SEGMENT_PARALLEL_MIN = 100000
+
+
+class NoProgress:
+    """
+    Progress callback that discards updates, for runs without a UI.
+    """
+
+    def emit(self, percent):
+        pass
+
+def iterPhotos(folder, exts=('.jpg',), recursive=False):
+    """
+    Find photos within the folder, yielding them as the walk goes.
+
+    Parameters
+    ----------
+    folder : string
+        Full path to the folder containing photos.
+    exts : tuple, optional
+        Supported photo extensions, matched case-insensitively. A single
+        extension may be given as a string. The default is ('.jpg',).
+    recursive : bool, optional
+        Also search the subfolders. The default is False.
+
+    Raises
+    ------
+    OSError
+        The folder cannot be listed. Unreadable subfolders are skipped.
+
+    Yields
+    ------
+    string
+        Full path to each photo matched with the search criteria.
+
+    """
+
+    if isinstance(exts, str):
+        exts = (exts,)
+    exts = tuple(e.lower() for e in exts)
+
+    # entry types come with the directory listing, no stat per file
+    folders = [str(folder)]
+    while folders:
+        top = folders.pop()
+        try:
+            entries = scandir(top)
+        except OSError:
+            if top == str(folder):
+                raise
+            continue
+        subfolders = list()
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        if entry.name.lower().endswith(exts):
+                            yield entry.path
+                    elif recursive and entry.is_dir(follow_symlinks=False):
+                        subfolders.append(entry.path)
+                except OSError:
+                    continue
+        folders.extend(reversed(subfolders))
+
+def getPhotos(folder, exts=('.jpg',), recursive=False):
     """
     Get a list of photos within the folder.
 
@@ -42,7 +121,9 @@ def getPhotos(folder, exts=('.jpg')):
     folder : string
         Full path to the folder containing photos.
     exts : tuple, optional
-        Supported photo extensions. The default is ('.jpg').
+        Supported photo extensions. The default is ('.jpg',).
+    recursive : bool, optional
+        Also search the subfolders. The default is False.
 
     Returns
     -------
@@ -51,21 +132,19 @@ def getPhotos(folder, exts=('.jpg')):
 
     """
 
-    # convert folder variable to string
-    folder = str(folder)
-
-    # get photos
-    imgs = []
-    if exists(folder):
-        imgs = [join(folder, f) for f in listdir(folder) if (isfile(join(folder, f)) and f.lower().endswith(exts))]
-
     # [] if no photos found
-    return imgs
+    if not exists(str(folder)):
+        return []
+    return list(iterPhotos(folder, exts, recursive))
 
 def getDateExif(filepath):
     """
     Extract datetime of the photo and format it.
 
+    headingCalculator reads the taken time together with the other tags
+    through ProcessMetadata; this function reads a single photo and
+    requires the exifread library.
+
     Parameters
     ----------
     filepath : string
@@ -78,6 +157,8 @@ def getDateExif(filepath):
 
     """
 
+    import exifread
+
     with open(filepath, 'rb') as fh:
         tags = exifread.process_file(fh, stop_tag="EXIF DateTimeOriginal")
         str_date = str(tags["EXIF DateTimeOriginal"])
@@ -119,7 +200,236 @@ def headingCalSingle(x1, y1, x2, y2):
 
     return heading
 
-def formatResult(result):
+def headingCalBatch(lon, lat):
+    """
+    Calculate heading angles in reference to the north of a whole sequence of photos.
+
+    This is the vectorized form of headingCalSingle: the heading of photo i
+    is computed from photos i-1 and i+1, for every photo but the first and the last.
+
+    Parameters
+    ----------
+    lon : array_like
+        GPS Longitude of the photos, sorted by taken time.
+    lat : array_like
+        GPS Latitude of the photos, sorted by taken time.
+
+    Returns
+    -------
+    headings : numpy.ndarray
+        Heading angles of photos 1 to n-2. NaN where a position is missing.
+
+    """
+
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+
+    # compute heading vectors; against north (0, 1) the dot product is hy
+    # and the determinant is hx
+    hx = lon[2:] - lon[:-2]
+    hy = lat[2:] - lat[:-2]
+
+    return np.arctan2(hx, hy) * (180 / 3.1415926535897)
+
+def distanceCalBatch(x, y):
+    """
+    Calculate distances between consecutive points of a sequence in 2D system.
+
+    Parameters
+    ----------
+    x : array_like
+        X coordinates of the points.
+    y : array_like
+        Y coordinates of the points.
+
+    Returns
+    -------
+    numpy.ndarray
+        Distance between point i and point i+1, for i = 0..n-2.
+
+    """
+
+    return np.hypot(np.diff(np.asarray(x, dtype=np.float64)), np.diff(np.asarray(y, dtype=np.float64)))
+
+def segmentFlights(timestamps, lon, lat, max_gap=SEGMENT_TIME_GAP, max_jump=SEGMENT_JUMP):
+    """
+    Split a sequence of photos into flights, at time gaps and distance jumps.
+
+    Parameters
+    ----------
+    timestamps : array_like
+        Taken time of the photos in seconds, sorted; NaN where unknown.
+    lon : array_like
+        GPS Longitude of the photos.
+    lat : array_like
+        GPS Latitude of the photos.
+    max_gap : float, optional
+        Largest time in seconds between two photos of a flight.
+        The default is SEGMENT_TIME_GAP; None does not split on time.
+    max_jump : float, optional
+        Largest distance between two photos of a flight, as a multiple of
+        the median distance between consecutive photos.
+        The default is SEGMENT_JUMP; None does not split on distance.
+
+    Returns
+    -------
+    list
+        (start, end) indexes of each flight, end excluded, in order.
+        Photos without time or position never start a flight.
+
+    """
+
+    n = len(lon)
+    breaks = np.zeros(max(n - 1, 0), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        if max_gap is not None and n > 1:
+            breaks |= np.diff(np.asarray(timestamps, dtype=np.float64)) > max_gap
+        if max_jump is not None and n > 1:
+            spacing = distanceCalBatch(lon, lat)
+            known = spacing[np.isfinite(spacing)]
+            median = np.median(known) if len(known) else 0.
+            if median > 0:
+                breaks |= spacing > max_jump * median
+    bounds = [0] + [int(i) + 1 for i in np.flatnonzero(breaks)] + [n]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def headingCalSegments(lon, lat, segments):
+    """
+    Calculate heading angles of a sequence of photos split into flights.
+
+    Each flight is calculated on its own with headingCalBatch; from
+    SEGMENT_PARALLEL_MIN photos on, the flights are calculated in parallel
+    threads, as numpy releases the GIL on large arrays.
+
+    Parameters
+    ----------
+    lon : array_like
+        GPS Longitude of the photos, sorted by taken time.
+    lat : array_like
+        GPS Latitude of the photos, sorted by taken time.
+    segments : list
+        (start, end) indexes of each flight, see segmentFlights.
+
+    Returns
+    -------
+    headings : numpy.ndarray
+        Heading angles of photos 1 to n-2, as for headingCalBatch. NaN for
+        the first and last photo of each flight, which have no neighbour
+        on one side.
+
+    """
+
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    headings = np.full(max(len(lon) - 2, 0), np.nan)
+
+    def compute(bounds):
+        start, end = bounds
+        return start, headingCalBatch(lon[start:end], lat[start:end])
+
+    if len(segments) > 1 and len(lon) >= SEGMENT_PARALLEL_MIN:
+        with ThreadPoolExecutor() as executor:
+            parts = list(executor.map(compute, segments))
+    else:
+        parts = map(compute, segments)
+
+    # headings of photos start+1 .. end-2
+    for start, part in parts:
+        headings[start:start + len(part)] = part
+    return headings
+
+def headingCalWindows(lon, lat, starts, indexes):
+    """
+    Calculate heading angles of some photos of a sequence split into flights.
+
+    This is headingCalBatch restricted to indexes: the heading of photo i
+    is computed from photos i-1 and i+1, if they belong to its flight.
+
+    Parameters
+    ----------
+    lon : array_like
+        GPS Longitude of the photos, sorted by taken time.
+    lat : array_like
+        GPS Latitude of the photos, sorted by taken time.
+    starts : array_like
+        True for the photos starting a flight, see segmentFlights.
+    indexes : array_like
+        Indexes of the photos to calculate.
+
+    Returns
+    -------
+    headings : numpy.ndarray
+        Heading angle of each photo of indexes. NaN for the first and last
+        photo of each flight, and where a position is missing.
+
+    """
+
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    starts = np.asarray(starts, dtype=bool)
+    idx = np.asarray(indexes, dtype=np.intp)
+
+    inner = (idx > 0) & (idx < len(lon) - 1)
+    inner[inner] = ~starts[idx[inner]] & ~starts[idx[inner] + 1]
+    i = idx[inner]
+    headings = np.full(len(idx), np.nan)
+    headings[inner] = np.arctan2(lon[i+1] - lon[i-1], lat[i+1] - lat[i-1]) * (180 / 3.1415926535897)
+    return headings
+
+def headingDiff(a, b):
+    """
+    Calculate the smallest difference between angles, across north.
+
+    Parameters
+    ----------
+    a : float or array
+        Angles in degrees.
+    b : float or array
+        Angles in degrees.
+
+    Returns
+    -------
+    float or array
+        Absolute difference in degrees, between 0 and 180; NaN where an angle is missing.
+
+    """
+
+    return np.abs((np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64) + 180.) % 360. - 180.)
+
+def sidecarHeadings(et, photos):
+    """
+    Read the heading already written to the XMP sidecars of photos.
+
+    Parameters
+    ----------
+    et : ExifTool or ExifToolPool
+        Running exiftool instance.
+    photos : list
+        Full paths to the photos.
+
+    Returns
+    -------
+    array
+        Heading of each photo, NaN if it has no sidecar or no heading in it.
+
+    """
+
+    sidecars = [sidecar_path(p) for p in photos]
+    existing = [p for p in sidecars if exists(p)]
+    values = dict()
+    if existing:
+        # streamed: exiftool replies nothing when no sidecar can be read
+        for d in et.iter_tags_batch([HEADING_TAG], existing):
+            values[normalize_path(d['SourceFile'])] = d.get(HEADING_TAG)
+    result = np.full(len(photos), np.nan)
+    for i, p in enumerate(sidecars):
+        try:
+            result[i] = float(values.get(normalize_path(p)))
+        except (TypeError, ValueError):
+            pass
+    return result
+
+def formatResult(result, failed=None, unchanged=0, segments=None, untimed=None):
     """
     Format the processing result of function headingCalculator to be displayed as log in the main UI.
 
@@ -127,6 +437,14 @@ def formatResult(result):
     ----------
     result : 2D list
         Contains photo name, heading, Latitude, Longitude for each photo.
+    failed : dict, optional
+        Photos whose heading could not be written, with the exiftool error.
+    unchanged : int, optional
+        Number of photos not written because their heading did not change.
+    segments : list, optional
+        (start, end) rows of result of each flight, when there are several.
+    untimed : list, optional
+        Photos left out of the flights because they have no taken time.
 
     Returns
     -------
@@ -139,11 +457,30 @@ def formatResult(result):
     len_s = len(result)
 
     log.append("Calculated heading for: {0} photos:".format(len_s))
+    if segments and len(segments) > 1:
+        log.append("Flights: {0} ({1} photos)".format(
+            len(segments), ", ".join(str(end - start) for start, end in segments)))
     log.append("----------")
     for i in range(0, len_s):
         r_ = "{0}: {1}".format(basename(result[i][0]), result[i][1])
         log.append(r_)
 
+    if unchanged:
+        log.append("----------")
+        log.append("Heading unchanged, not written: {0} photos".format(unchanged))
+
+    if failed:
+        log.append("----------")
+        log.append("Failed to write heading to: {0} photos:".format(len(failed)))
+        for path, error in failed.items():
+            log.append("{0}: {1}".format(basename(path), error))
+
+    if untimed:
+        log.append("----------")
+        log.append("No taken time, heading not calculated: {0} photos:".format(len(untimed)))
+        for path in untimed:
+            log.append(basename(path))
+
     log = "\n".join(str(x) for x in log)
     log = log + "\n"
     return log
@@ -172,7 +509,9 @@ def distanceCal(x1, y1, x2, y2):
 
     return sqrt((x1-x2)**2 + (y1-y2)**2)
 
-def headingCalculator(folder, imgexts, progress_callback):
+def headingCalculator(folder, imgexts, progress_callback=None, et=None, cache=None, cancel=None, phase_callback=None,
+                      sidecar=False, skip_unchanged=False, tolerance=HEADING_TOLERANCE, processes=None,
+                      recursive=False, max_gap=SEGMENT_TIME_GAP, max_jump=SEGMENT_JUMP, incremental=False):
     """
     Calculate heading angle for suitable photos within the folder.
 
@@ -182,14 +521,66 @@ def headingCalculator(folder, imgexts, progress_callback):
         Full path to the folder containing photos.
     imgexts : tuple
         Supported photo extensions.
-    progress_callback : object
-        Object to update progress to the main UI.
+    progress_callback : object, optional
+        Object to update progress to the main UI, through its emit method.
+        Updates are throttled to changes of the integer percentage.
+        The default is None, which reports no progress.
+    et : ExifTool or ExifToolPool, optional
+        Running exiftool instance used for reading and writing tags.
+        The default is None, which starts a pool for this call only.
+    cache : MetadataCache, optional
+        Cache of metadata records, so reruns only read new or changed photos.
+        The default is None, which reads all photos.
+    cancel : CancelToken, optional
+        Token to pause or cancel the run; checked while reading metadata,
+        in the compute loop and before each write step.
+        The default is None, which runs to completion.
+    phase_callback : object, optional
+        Object receiving the name of each phase (read, sort, segment,
+        compute, write) as it starts, through its emit method.
+        The default is None.
+    sidecar : bool, optional
+        Write headings to an XMP sidecar next to each photo (photo name with
+        the .xmp extension) instead of rewriting the photos.
+        The default is False.
+    skip_unchanged : bool, optional
+        Only write photos whose new heading differs by more than tolerance
+        from the FlightYawDegree already written (in the photo, or in its
+        sidecar in sidecar mode), so reruns over processed folders write nothing.
+        The default is False, which writes all photos.
+    tolerance : float, optional
+        Largest heading change in degrees treated as unchanged.
+        The default is HEADING_TOLERANCE.
+    processes : int, optional
+        Number of worker processes parsing photo headers; 1 parses them in
+        the calling thread.  The default is None, which uses all CPUs for
+        large folders.
+    recursive : bool, optional
+        Also process the photos of subfolders, as one sequence.
+        The default is False.
+    max_gap : float, optional
+        Photos taken more than max_gap seconds apart belong to different
+        flights, whose headings are calculated separately.
+        The default is SEGMENT_TIME_GAP; None does not split on time.
+    max_jump : float, optional
+        Photos farther apart than max_jump times the median photo spacing
+        belong to different flights.
+        The default is SEGMENT_JUMP; None does not split on distance.
+    incremental : bool, optional
+        Keep the timeline and headings of the folder in a state file (see
+        FolderState) and, on reruns, read only the photos added or changed
+        since, and recompute and write only them and their neighbours.
+        The default is False, which processes all photos.
 
     Raises
     ------
     Exception
         1. Less than 3 photos found in the folder -> cannot calculate heading angle.
         2. Failed calling batch update exiftool -> exiftool is not working.
+    JobCancelled
+        The run was cancelled through the token; no photo has been written
+        unless the write had started, in which case the chunks of photos
+        already sent to exiftool are written.
 
     Returns
     -------
@@ -198,84 +589,353 @@ def headingCalculator(folder, imgexts, progress_callback):
             - heading: a list of heading angles.
             - avgdist: average distance between photos
             - msg: log to be displayed in the main UI.
+            - failed: photos whose heading could not be written, with the error.
+            - unchanged: number of photos skipped because their heading did not change.
+            - untimed: photos without taken time, left out of the flights.
+            - segments: (start, end) rows of heading of each flight, end excluded.
+            - stats: wall time, files and exiftool traffic (commands sent,
+              bytes read from its output) of each phase, see JobStats;
+              the folder walk runs during the read phase.
 
     """
 
-    # get photos
-    photos = getPhotos(folder, imgexts)
-    n_photos = len(photos)
+    if progress_callback is None:
+        progress_callback = NoProgress()
+    if cancel is None:
+        cancel = CancelToken()
+    cancel.check()
+    if not exists(str(folder)):
+        raise Exception('At least 3 photos are required to calculate heading!')
+
+    # one set of exiftool processes serves both the read and the write
+    own_et = et is None
+    if own_et:
+        et = ExifToolPool()
+        et.start()
+    stats = JobStats(et)
+    progress = ProgressReporter(progress_callback, phase_callback, stats=stats)
+    try:
+        # find photos; the walk feeds the metadata reader as it goes, so a
+        # folder with less than 3 photos is only detected after reading,
+        # and the time of the walk counts in the read phase
+        photos = iterPhotos(folder, imgexts, recursive)
+        if incremental:
+            exts = [imgexts] if isinstance(imgexts, str) else list(imgexts)
+            state = FolderState(folder, {'exts': sorted(e.lower() for e in exts), 'recursive': bool(recursive),
+                                         'sidecar': bool(sidecar), 'max_gap': max_gap, 'max_jump': max_jump})
+            state.load()
+            return _incrementalHeadingCalculator(folder, photos, state, progress, et, cache, cancel, sidecar,
+                                                 skip_unchanged, tolerance, processes, stats, max_gap, max_jump)
+        return _headingCalculator(folder, photos, progress, et, cache, cancel, sidecar,
+                                  tolerance if skip_unchanged else None, processes, stats,
+                                  max_gap, max_jump)
+    finally:
+        if own_et:
+            et.terminate()
+
+def _headingCalculator(folder, photos, progress, et, cache, cancel, sidecar=False, tolerance=None, processes=None,
+                       stats=None, max_gap=SEGMENT_TIME_GAP, max_jump=SEGMENT_JUMP):
+    """
+    Read metadata, then calculate and write heading angles for the photos.
+    See headingCalculator.
+    """
 
-    # if photos is empty or less than 3, then halt processing
+    # initialize process metadata object, taken time is read in the same pass
+    proobj = ProcessMetadata(photos, et=et, cache=cache, cancel=cancel, progress=progress, processes=processes,
+                             stats=stats)
+
+    # sort photos by taken time; photos without time cannot be placed in a
+    # flight, they are left out and listed in the log
+    progress.phase('sort')
+    timestamps = proobj.timestamps()
+    timed = np.isfinite(timestamps)
+    sourcefiles = list(proobj.column('sourcefile'))
+    untimed = [f for f, t in zip(sourcefiles, timed) if not t]
+    order = np.flatnonzero(timed)
+    order = order[_timeOrder(timestamps[order], [sourcefiles[i] for i in order])]
+    proobj.sort(order)
+    timestamps = timestamps[order]
+    flist = list(proobj.column('sourcefile'))
+    flights = [[f] for f in flist]
+
+    n_photos = len(flights)
     if n_photos < 3:
         raise Exception('At least 3 photos are required to calculate heading!')
 
-    # this variable is used to keep track of progress
-    N = n_photos - 2
+    # split the photos into flights at time gaps and distance jumps, so
+    # the photos at the joins do not take a heading across two flights
+    progress.phase('segment')
+    lon, lat = proobj.column(LONGITUDE), proobj.column(LATITUDE)
+    segments = segmentFlights(timestamps, lon, lat, max_gap, max_jump)
 
-    # sort photos by taken time
-    photo_dates = [getDateExif(i) for i in photos]
-    photo_timestamps = [int(x.timestamp()) for x in photo_dates]
+    # calculate heading of each flight at once
+    headings = headingCalSegments(lon, lat, segments)
+    spacing = distanceCalBatch(lon, lat)
 
-    flights = list()
-    flights.append(photos)
-    flights.append(photo_timestamps)
-    flights = [list(i) for i in zip(*flights)]
-    flights.sort(key=lambda x : x[1] , reverse = False)
+    # change from the heading already written, NaN where there is none
+    if tolerance is not None:
+        previous = sidecarHeadings(et, flist[1:-1]) if sidecar else proobj.column(FLIGHT_YAW)[1:-1]
+        unchanged = headingDiff(headings, previous) <= tolerance
+    unchanged_count = 0
 
-    # initialize process metadata object
-    #proobj = ProcessMetadata(flights[:,0])
-    flist = [i[0] for i in flights]
-    proobj = ProcessMetadata(flist)
-
-    # calculate heading and write it back to the image
+    # collect results to write back to the images
     result = list()
     update_txt = list()
     distl = list()
-    for i in range(1, n_photos-1):
+    tracks = list()
+    progress.phase('compute', n_photos - 2)
+    for start, end in segments:
+        first = len(result)
+        for i in range(max(start, 1), min(end, n_photos-1)):
 
-        # if photo has heading already, skip to next
-        this_spec = proobj.format_tag_index(i)
+            cancel.check()
+            progress.advance()
 
-        img1_spec = proobj.format_tag_index(i-1)
-        img2_spec = proobj.format_tag_index(i+1)
+            # heading of the photo, from the positions of its neighbours
+            heading = float(headings[i-1])
 
-        x1, y1 = img1_spec[LONGITUDE], img1_spec[LATITUDE]
-        x2, y2 = img2_spec[LONGITUDE], img2_spec[LATITUDE]
+            # photos without GPS position on either side, and the first and
+            # last photo of each flight, get no heading
+            if not isfinite(heading):
+                continue
 
-        heading = headingCalSingle(x1, y1, x2, y2)
-        distl.append(distanceCal(this_spec[LONGITUDE], this_spec[LATITUDE], x1, y1))
+            distl.append(float(spacing[i-1]))
 
-        # update txt
-        #update_txt.append("{0},{1}".format(flights[i][0], heading))
-        update_txt.append([flights[i][0], heading])
+            # update txt, unless the photo has this heading already
+            #update_txt.append("{0},{1}".format(flights[i][0], heading))
+            if tolerance is not None and unchanged[i-1]:
+                unchanged_count += 1
+            else:
+                update_txt.append([flights[i][0], heading])
 
-        # update result to log
-        result.append([flights[i][0], round(heading, 2), this_spec[LONGITUDE], this_spec[LATITUDE]])
+            # update result to log
+            result.append([flights[i][0], round(heading, 2), float(lon[i]), float(lat[i])])
+        if len(result) > first:
+            tracks.append((first, len(result)))
 
-        # set progress
-        percent = float(i/N) * 100
-        progress_callback.emit(percent)
+    if not result:
+        raise Exception('Cannot calculate heading: photos have no GPS position!')
 
-    # run system command to update image with ground altitude information
-    ## first, create a csv file
-    csvname = join(folder, "update_heading.csv")
-    header_ = ["SourceFile", "FlightYawDegree"]
-    with open(csvname, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=header_, delimiter=',')
-        writer.writeheader()
-        for r in update_txt:
-            writer.writerow({header_[0]:r[0], header_[1]:str(r[1])})
+    written = _writeHeadings(folder, update_txt, progress, et, cache, proobj.tags, cancel, sidecar, stats)
 
-    ## then, update tags
-    with ExifTool() as et:
-        status = et.write_tag_batch(csvname, folder)
-        if not status:
-            raise Exception('Failed calling batch update exiftool: [Input folder]: {0}'.format(folder))
+    progress.finish()
 
     # format and return log
-    log = formatResult(result)
+    log = formatResult(result, written.failed, unchanged_count, tracks, untimed)
 
     # compute average distance between photos
     avgdist = sum(distl) / len(distl)
 
-    return {'heading': result, 'avgdist': avgdist, 'msg': log}
+    return {'heading': result, 'avgdist': avgdist, 'msg': log, 'failed': written.failed,
+            'unchanged': unchanged_count, 'untimed': untimed, 'segments': tracks,
+            'stats': stats.as_dict() if stats is not None else None}
+
+def _timeOrder(timestamps, paths):
+    """
+    Indices sorting photos by taken time, then by path.
+
+    Photos taken at the same time are ordered by path rather than by read
+    order, which depends on the cache, so they keep their neighbours from
+    one run to the next.
+    """
+
+    return np.lexsort((np.array([normalize_path(p) for p in paths]), timestamps))
+
+def _splice(old, new):
+    """
+    Float array of the values of the timeline followed by those of the new photos.
+    """
+
+    return np.concatenate([np.asarray(old, dtype=np.float64), np.asarray(new, dtype=np.float64)])
+
+def _neighbours(files, starts):
+    """
+    Photos before and after each photo in its flight, None at the ends.
+    """
+
+    n = len(files)
+    return [(files[i-1] if i > 0 and not starts[i] else None,
+             files[i+1] if i + 1 < n and not starts[i+1] else None) for i in range(n)]
+
+def _incrementalHeadingCalculator(folder, photos, state, progress, et, cache, cancel, sidecar=False,
+                                  skip_unchanged=False, tolerance=HEADING_TOLERANCE, processes=None, stats=None,
+                                  max_gap=SEGMENT_TIME_GAP, max_jump=SEGMENT_JUMP):
+    """
+    Update the headings of a folder from the timeline of the last run.
+    See headingCalculator.
+    """
+
+    # photos are new when they are not in the timeline, or changed since;
+    # the walk counts in the read phase, as in a full run
+    progress.phase('read', 0)
+    current = dict()
+    for p in checked(photos, cancel):
+        try:
+            st = stat(p)
+        except OSError:
+            continue
+        current[p] = (st.st_size, st.st_mtime_ns)
+    kept = [e for e in state.entries if current.get(e['file']) == (e['size'], e['mtime_ns'])]
+    known = set(e['file'] for e in kept)
+    new = [p for p in current if p not in known]
+    # changed photos are read again as new ones, not counted as removed
+    removed = sum(1 for e in state.entries if e['file'] not in current)
+
+    # only the new photos are read
+    proobj = ProcessMetadata(new, et=et, cache=cache, cancel=cancel, progress=progress, processes=processes,
+                             stats=stats)
+    # exiftool echoes the paths back in its own form (forward slashes on
+    # Windows): the timeline keeps the paths of the directory walk
+    walked = dict((normalize_path(p), p) for p in current)
+    new = [walked[normalize_path(f)] for f in proobj.column('sourcefile')]
+    # new photos without taken time are left out of the timeline, and
+    # read again by the next run
+    timed = np.isfinite(proobj.timestamps())
+    untimed = [f for f, t in zip(new, timed) if not t]
+    proobj.sort(np.flatnonzero(timed))
+    new = [f for f, t in zip(new, timed) if t]
+    if skip_unchanged:
+        written_new = sidecarHeadings(et, new) if sidecar else proobj.column(FLIGHT_YAW)
+    else:
+        written_new = np.full(len(new), np.nan)
+
+    # splice the new photos into the timeline, in the order of a full run
+    progress.phase('sort')
+    timestamps = _splice([e['time'] for e in kept], proobj.timestamps())
+    order = _timeOrder(timestamps, [e['file'] for e in kept] + new)
+    timestamps = timestamps[order]
+    files = [(kept[i]['file'] if i < len(kept) else new[i - len(kept)]) for i in order]
+    lon = _splice([e['lon'] for e in kept], proobj.column(LONGITUDE))[order]
+    lat = _splice([e['lat'] for e in kept], proobj.column(LATITUDE))[order]
+    old_headings = _splice([e['heading'] for e in kept], np.full(len(new), np.nan))[order]
+    # heading already in the photo, NaN where unknown
+    previous = _splice([e['heading'] if e['written'] else np.nan for e in kept], written_new)[order]
+    fresh = (order >= len(kept))
+    pending = np.array([not e['written'] for e in kept] + [False] * len(new), dtype=bool)[order]
+
+    n_photos = len(files)
+    if n_photos < 3:
+        raise Exception('At least 3 photos are required to calculate heading!')
+
+    progress.phase('segment')
+    segments = segmentFlights(timestamps, lon, lat, max_gap, max_jump)
+    starts = np.zeros(n_photos, dtype=bool)
+    starts[[start for start, end in segments]] = True
+
+    # the heading of a photo only depends on its neighbours in its flight:
+    # photos whose neighbours changed are recomputed, with the new photos,
+    # their neighbours and the photos whose heading could not be written
+    old_files = [e['file'] for e in state.entries]
+    before = dict(zip(old_files, _neighbours(old_files, [e['start'] for e in state.entries])))
+    affected = fresh | pending
+    affected[1:] |= fresh[:-1]
+    affected[:-1] |= fresh[1:]
+    affected |= np.array([n != before.get(f) for f, n in zip(files, _neighbours(files, starts))], dtype=bool)
+
+    cancel.check()
+    indexes = np.flatnonzero(affected)
+    progress.phase('compute', len(indexes))
+    headings = old_headings.copy()
+    headings[indexes] = headingCalWindows(lon, lat, starts, indexes)
+    progress.advance(len(indexes))
+
+    # write the recomputed headings, unless skip_unchanged and the photo
+    # has this heading already
+    finite = np.isfinite(headings)
+    if skip_unchanged:
+        same = headingDiff(headings, previous) <= tolerance
+    else:
+        same = np.zeros(n_photos, dtype=bool)
+    to_write = affected & finite & ~same
+    unchanged_count = int(np.count_nonzero(affected & finite & same))
+    update_txt = [[files[i], float(headings[i])] for i in np.flatnonzero(to_write)]
+
+    # collect results of the whole timeline
+    spacing = distanceCalBatch(lon, lat)
+    result = list()
+    tracks = list()
+    distl = list()
+    for start, end in segments:
+        first = len(result)
+        for i in range(start, end):
+            if finite[i]:
+                distl.append(float(spacing[i-1]))
+                result.append([files[i], round(float(headings[i]), 2), float(lon[i]), float(lat[i])])
+        if len(result) > first:
+            tracks.append((first, len(result)))
+
+    if not result:
+        raise Exception('Cannot calculate heading: photos have no GPS position!')
+
+    written = _writeHeadings(folder, update_txt, progress, et, cache, proobj.tags, cancel, sidecar, stats)
+
+    # keep the timeline for the next run, with the photos as they are now
+    changed = set(written.updated) | set(written.unchanged)
+    entries = list()
+    for i, f in enumerate(files):
+        if f in changed:
+            st = stat(f)
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        else:
+            size, mtime_ns = current[f]
+        entries.append({'file': f, 'size': size, 'mtime_ns': mtime_ns, 'time': timestamps[i], 'lon': lon[i],
+                        'lat': lat[i], 'start': starts[i], 'heading': headings[i],
+                        'written': not (to_write[i] and f in written.failed)})
+    notes = ["Incremental: {0} new photos, {1} removed, {2} recomputed, {3} written".format(
+        int(np.count_nonzero(fresh)), removed, len(indexes), len(update_txt) - len(written.failed))]
+    try:
+        state.save(entries)
+    except Exception as e:
+        notes.append(str(e))
+
+    progress.finish()
+
+    log = "\n".join(notes) + "\n" + formatResult(result, written.failed, unchanged_count, tracks, untimed)
+    avgdist = sum(distl) / len(distl)
+
+    return {'heading': result, 'avgdist': avgdist, 'msg': log, 'failed': written.failed,
+            'unchanged': unchanged_count, 'untimed': untimed, 'segments': tracks,
+            'stats': stats.as_dict() if stats is not None else None}
+
+def _writeHeadings(folder, update_txt, progress, et, cache, tags, cancel, sidecar=False, stats=None):
+    """
+    Write the headings of update_txt ([photo, heading] pairs), return the WriteResult.
+    See headingCalculator.
+    """
+
+    # stream one write command per photo to exiftool, in chunks; a
+    # cancelled run stops after the chunk being written
+    cancel.check()
+    progress.phase('write', len(update_txt))
+    written = WriteResult()
+    try:
+        for f, status, message in checked(et.iter_write_tag_batch(HEADING_TAG, update_txt, sidecar=sidecar),
+                                          cancel, progress):
+            written.add(f, status, message)
+    except (ValueError, IOError):
+        raise Exception('Failed calling batch update exiftool: [Input folder]: {0}'.format(folder))
+
+    # photos exiftool could not write (e.g. locked by another program) get
+    # one more try, the others are not rewritten
+    if written.failed:
+        cancel.check()
+        if stats is not None:
+            stats.add('retried', len(written.failed))
+        written.merge(et.write_tag_batch(HEADING_TAG, written.retry_values(update_txt), sidecar=sidecar))
+    if update_txt and not written.updated and not written.unchanged:
+        raise Exception('Failed calling batch update exiftool: [Input folder]: {0}: {1}'.format(
+            folder, next(iter(written.failed.values()))))
+
+    # the write changed the photos, keep their cached records valid
+    if cache is not None and not sidecar:
+        values = dict((f, h) for f, h in update_txt)
+        cache.restat(written.updated, tags,
+                     dict((f, {HEADING_TAG: values[f]}) for f in written.updated))
+
+    return written
+
+if __name__ == '__main__':
+    # python -m heading_calculator: headless batch processing
+    import sys
+    from cli import main
+    sys.exit(main())
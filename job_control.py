@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+from threading import Event
+from time import monotonic, perf_counter
+
+
+# phases of a heading job and their share of the overall progress
+PHASES = (('read', 60), ('sort', 3), ('segment', 2), ('compute', 10), ('write', 25))
+
+
+class JobCancelled(Exception):
+    """
+    Raised at a checkpoint of a job whose CancelToken was cancelled.
+    """
+
+
+class CancelToken:
+    """
+    Cooperative cancellation and pause of a running job.
+
+    The job calls check() at its checkpoints (each metadata record, each
+    photo of the compute loop, each write step); check() blocks while the
+    token is paused and raises JobCancelled once it is cancelled.
+    cancel(), pause() and resume() may be called from any thread.
+    """
+
+    def __init__(self):
+
+        self._cancelled = Event()
+        self._running = Event()
+        self._running.set()
+
+    @property
+    def cancelled(self):
+
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+
+        return not self._running.is_set()
+
+    def cancel(self):
+        """
+        Request the job to stop at its next checkpoint; wakes a paused job.
+        """
+
+        self._cancelled.set()
+        self._running.set()
+
+    def pause(self):
+        """
+        Hold the job at its next checkpoint until resume() or cancel().
+        """
+
+        if not self.cancelled:
+            self._running.clear()
+
+    def resume(self):
+
+        self._running.set()
+
+    def check(self):
+        """
+        Checkpoint: wait while paused, raise JobCancelled if cancelled.
+        """
+
+        if not self._running.is_set():
+            self._running.wait()
+        if self._cancelled.is_set():
+            raise JobCancelled('Job cancelled')
+
+
+def checked(iterable, token, progress=None):
+    """
+    Iterate with a checkpoint before each item.
+
+    The source is closed when iteration stops early, so a stream from
+    exiftool restarts its process instead of leaving output on the pipe.
+
+    Parameters
+    ----------
+    iterable : iterable
+        Source of items, e.g. a stream of exiftool records.
+    token : CancelToken
+        Token checked before each item, may be None.
+    progress : ProgressReporter, optional
+        Reporter advanced by one for each item.
+
+    """
+
+    it = iter(iterable)
+    try:
+        for item in it:
+            if token is not None:
+                token.check()
+            yield item
+            if progress is not None:
+                progress.advance()
+    finally:
+        close = getattr(it, 'close', None)
+        if close is not None:
+            close()
+
+
+class Callback:
+    """
+    Adapter giving a plain function the emit method of a Qt signal.
+    """
+
+    def __init__(self, func):
+
+        self.emit = func
+
+
+class JobStats:
+    """
+    Wall time, file count and exiftool traffic of each phase of a job.
+
+    A stage is opened by stage() and closed by the next stage() or by
+    stop().  The exiftool commands sent and the bytes read from its
+    output pipe are taken from the counters of et at both ends of the
+    stage, so a shared pool only reports the traffic of this job when
+    no other job runs at the same time.  Other counters of the current
+    stage (e.g. photos found in the cache) are added with add().
+    """
+
+    def __init__(self, et=None):
+
+        self.et = et
+        self.stages = dict()
+        self.current = None
+        self.start = None
+        self.start_io = None
+
+    def _io(self):
+
+        if self.et is None:
+            return 0, 0
+        return getattr(self.et, 'commands', 0), getattr(self.et, 'bytes_read', 0)
+
+    def stage(self, name):
+        """
+        Start timing stage name; the current stage is stopped.
+        """
+
+        self.stop()
+        self.current = self.stages.setdefault(name, {'seconds': 0.0, 'files': 0,
+                                                     'exiftool_commands': 0, 'exiftool_bytes': 0})
+        self.start = perf_counter()
+        self.start_io = self._io()
+
+    def add(self, key, n=1):
+        """
+        Add n to counter key of the current stage.
+        """
+
+        if self.current is not None:
+            self.current[key] = self.current.get(key, 0) + n
+
+    def stop(self, files=0):
+        """
+        Stop timing the current stage, which processed files files.
+        """
+
+        if self.current is None:
+            return
+        commands, nbytes = self._io()
+        self.current['seconds'] += perf_counter() - self.start
+        self.current['files'] += files
+        self.current['exiftool_commands'] += commands - self.start_io[0]
+        self.current['exiftool_bytes'] += nbytes - self.start_io[1]
+        self.current = None
+
+    def as_dict(self):
+        """
+        Counters of each stage in the order they ran, and their 'total'.
+        """
+
+        result = dict((name, dict(counters)) for name, counters in self.stages.items())
+        total = dict()
+        for counters in self.stages.values():
+            for key in ('seconds', 'exiftool_commands', 'exiftool_bytes'):
+                total[key] = total.get(key, 0) + counters[key]
+        result['total'] = total
+        return result
+
+
+def formatStats(stats):
+    """
+    Format the stats of a job (see JobStats.as_dict) as a text table.
+    """
+
+    lines = ["{0:<8} {1:>9} {2:>8} {3:>9} {4:>11}  {5}".format(
+        'stage', 'seconds', 'files', 'exiftool', 'pipe bytes', 'other')]
+    for name, counters in stats.items():
+        other = ", ".join("{0}: {1}".format(k, v) for k, v in counters.items()
+                          if k not in ('seconds', 'files', 'exiftool_commands', 'exiftool_bytes'))
+        lines.append("{0:<8} {1:9.3f} {2:>8} {3:>9} {4:>11}  {5}".format(
+            name, counters['seconds'], counters.get('files', ''), counters['exiftool_commands'],
+            counters['exiftool_bytes'], other).rstrip())
+    return "\n".join(lines)
+
+
+class ProgressReporter:
+    """
+    Throttled progress of a job made of weighted phases.
+
+    Each phase covers a share of the overall percentage (see PHASES).
+    The overall percentage is emitted through progress_callback only
+    when its integer value changes, or when interval seconds passed
+    since the last emit, so a run over 100k photos sends about a hundred
+    updates instead of one per photo.  The name of each phase is emitted
+    through phase_callback when it starts.  With stats, each phase is
+    also timed as a stage of the JobStats, with its steps as files.
+    """
+
+    def __init__(self, progress_callback, phase_callback=None, phases=PHASES, interval=1.0, stats=None):
+
+        self.progress_callback = progress_callback
+        self.phase_callback = phase_callback
+        self.stats = stats
+        self.interval = interval
+        scale = 100.0 / sum(w for _, w in phases)
+        self.offsets = dict()
+        self.weights = dict()
+        offset = 0.0
+        for name, weight in phases:
+            self.offsets[name] = offset
+            self.weights[name] = weight * scale
+            offset += weight * scale
+        self.current = None
+        self.total = 0
+        self.done = 0
+        self.last_percent = -1
+        self.last_time = 0.0
+
+    def phase(self, name, total=1):
+        """
+        Start a phase of total steps; earlier phases count as complete.
+        """
+
+        if self.stats is not None:
+            self.stats.stop(self.done)
+            self.stats.stage(name)
+        self.current = name
+        self.total = total
+        self.done = 0
+        if self.phase_callback is not None:
+            self.phase_callback.emit(name)
+        self._report(force=True)
+
+    def advance(self, n=1):
+        """
+        Mark n more steps of the current phase as done.
+        """
+
+        self.done += n
+        self._report()
+
+    def counted(self, iterable):
+        """
+        Iterate over the steps of the current phase, counting them as they come.
+
+        For phases whose number of steps is not known in advance, e.g.
+        photos found by a directory walk that is still running.
+        """
+
+        for item in iterable:
+            self.total += 1
+            yield item
+
+    def finish(self):
+
+        if self.stats is not None:
+            self.stats.stop(self.done)
+        self.current = None
+        self._report(force=True)
+
+    def percent(self):
+        """
+        Overall progress in percent.
+        """
+
+        if self.current is None:
+            return 100.0 if self.last_percent >= 0 else 0.0
+        fraction = min(self.done, self.total) / max(self.total, 1)
+        return self.offsets[self.current] + self.weights[self.current] * fraction
+
+    def _report(self, force=False):
+
+        # a growing phase total must not move the bar back
+        percent = max(int(self.percent()), self.last_percent)
+        now = monotonic()
+        if force or percent != self.last_percent or now - self.last_time >= self.interval:
+            self.last_percent = percent
+            self.last_time = now
+            self.progress_callback.emit(percent)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+from PyQt5.QtWidgets import QTableWidget, QTableWidgetItem, QProgressBar, QAbstractItemView, QHeaderView, QMenu
+from PyQt5.QtCore import pyqtSignal, Qt
+from os.path import isdir
+
+class JobTable(QTableWidget):
+    """
+    Queue of heading jobs, one row per folder.
+
+    Folders dropped on the table are emitted with foldersDropped; the
+    context menu of a row requests to pause, resume or cancel its job.
+    """
+
+    foldersDropped = pyqtSignal(list)
+    pauseRequested = pyqtSignal(int)
+    resumeRequested = pyqtSignal(int)
+    cancelRequested = pyqtSignal(int)
+
+    FOLDER = 0
+    STATUS = 1
+    PROGRESS = 2
+
+    def __init__(self, parent):
+        super(JobTable, self).__init__(parent)
+
+        # columns are declared in main.ui
+        self.verticalHeader().setVisible(False)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setAcceptDrops(True)
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.customContextMenuRequested.connect(self.onContextMenu)
+
+    def onContextMenu(self, pos):
+        row = self.rowAt(pos.y())
+        if row < 0:
+            return
+        menu = QMenu(self)
+        pause = menu.addAction("Pause")
+        resume = menu.addAction("Resume")
+        cancel = menu.addAction("Cancel")
+        action = menu.exec_(self.viewport().mapToGlobal(pos))
+        if action is pause:
+            self.pauseRequested.emit(row)
+        elif action is resume:
+            self.resumeRequested.emit(row)
+        elif action is cancel:
+            self.cancelRequested.emit(row)
+
+    def droppedFolders(self, event):
+        urls = event.mimeData().urls()
+        return [u.toLocalFile() for u in urls if u.isLocalFile() and isdir(u.toLocalFile())]
+
+    def dragEnterEvent(self, event):
+        if self.droppedFolders(event):
+            event.acceptProposedAction()
+
+    def dragMoveEvent(self, event):
+        if self.droppedFolders(event):
+            event.acceptProposedAction()
+
+    def dropEvent(self, event):
+        folders = self.droppedFolders(event)
+        if folders:
+            event.acceptProposedAction()
+            self.foldersDropped.emit(folders)
+
+    def addJob(self, folder):
+        """
+        Append a queued job for the folder, return its row.
+        """
+
+        row = self.rowCount()
+        if row == 0:
+            self.horizontalHeader().setSectionResizeMode(self.FOLDER, QHeaderView.Stretch)
+        self.insertRow(row)
+        item = QTableWidgetItem(folder)
+        item.setToolTip(folder)
+        self.setItem(row, self.FOLDER, item)
+        self.setItem(row, self.STATUS, QTableWidgetItem("Queued"))
+        progress = QProgressBar(self)
+        progress.setValue(0)
+        self.setCellWidget(row, self.PROGRESS, progress)
+        return row
+
+    def setStatus(self, row, status):
+        self.item(row, self.STATUS).setText(status)
+
+    def setProgress(self, row, n):
+        self.cellWidget(row, self.PROGRESS).setValue(int(n))
+
+    def progress(self, row):
+        return self.cellWidget(row, self.PROGRESS).value()
+
+    def folder(self, row):
+        return self.item(row, self.FOLDER).text()
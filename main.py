@@ -28,20 +28,36 @@
 """
 
 from PyQt5.QtWidgets import QMainWindow, QFileDialog, QApplication, QGraphicsScene, QFrame, QGraphicsItem
-from PyQt5.QtGui import QIcon, QBrush, QPen, QColor, QPolygon
+from PyQt5.QtGui import QIcon, QBrush, QPen, QColor, QPolygon, QFontDatabase, QPainterPath
 from PyQt5.QtCore import QObject, pyqtSignal, QRunnable, pyqtSlot, QThreadPool, QDateTime, Qt, QRectF, QPoint
 from PyQt5.uic import loadUiType
 
-import traceback, sys
+import traceback, sys, multiprocessing
+from os import cpu_count, environ
 from os.path import join
+from functools import partial
 
 import resources_rc
 import folder_edit
+import job_table
 from heading_calculator import headingCalculator
-from pyexiftool import resource_path
+from job_control import CancelToken, JobCancelled, formatStats
+from metadata_cache import MetadataCache
+from pyexiftool import resource_path, ExifToolPool
+from profiling import profiled
 
 
-MAX_THREADS = 2
+# number of jobs running at once, further jobs wait in the queue
+MAX_THREADS = max(2, cpu_count() or 1)
+
+# directory receiving a cProfile profile of each job, profiling is off when unset;
+# HEADING_CALCULATOR_PROFILE_MEMORY=1 also traces memory allocations
+PROFILE_DIR = environ.get('HEADING_CALCULATOR_PROFILE')
+PROFILE_MEMORY = environ.get('HEADING_CALCULATOR_PROFILE_MEMORY', '') not in ('', '0')
+
+
+# colors of the tracks of the flights found in a folder, in turn
+TRACK_COLORS = (Qt.red, Qt.blue, Qt.darkGreen, Qt.magenta, Qt.darkYellow, Qt.darkCyan)
 
 
 FORM_CLASS,_ = loadUiType(resource_path('main.ui'))
@@ -49,12 +65,13 @@ FORM_CLASS,_ = loadUiType(resource_path('main.ui'))
 
 class QGraphicsArrowItem(QGraphicsItem):
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, color=Qt.red):
         super().__init__(parent)
         self.x = 0
         self.y = 0
         self.w = 25
         self.h = 0
+        self.color = color
 
     def boundingRect(self):
         return QRectF(self.x, self.y, self.w, self.h)
@@ -64,7 +81,7 @@ class QGraphicsArrowItem(QGraphicsItem):
         pen = QPen(QColor("black"))
         pen.setWidth(2)
         painter.setPen(pen)
-        painter.setBrush(QBrush(Qt.red, Qt.SolidPattern))
+        painter.setBrush(QBrush(self.color, Qt.SolidPattern))
         painter.drawLine(self.x, self.y, self.w, self.h)
         points = [
             QPoint(17,5),
@@ -84,6 +101,9 @@ class WorkerSignals(QObject):
 
     Supported signals are:
 
+    started
+        No data
+
     finished
         No data
 
@@ -96,11 +116,16 @@ class WorkerSignals(QObject):
     progress
         int indicating % progress
 
+    phase
+        str name of the phase the job entered
+
     '''
+    started = pyqtSignal()
     finished = pyqtSignal()
     error = pyqtSignal(tuple)
     result = pyqtSignal(object)
     progress = pyqtSignal(int)
+    phase = pyqtSignal(str)
 
 
 class Worker(QRunnable):
@@ -115,19 +140,22 @@ class Worker(QRunnable):
     :param args: Arguments to pass to the callback function
     :param kwargs: Keywords to pass to the callback function
 
+    When PROFILE_DIR is set, the callback is profiled (see profiling.profiled).
+
     '''
 
     def __init__(self, func, *args, **kwargs):
         super(Worker, self).__init__()
 
         # Store constructor arguments (re-used for processing)
-        self.func = func
+        self.func = func if PROFILE_DIR is None else profiled(func, PROFILE_DIR, PROFILE_MEMORY)
         self.args = args
         self.kwargs = kwargs
         self.signals = WorkerSignals()
 
         # Add the callback to our kwargs
         self.kwargs['progress_callback'] = self.signals.progress
+        self.kwargs['phase_callback'] = self.signals.phase
 
     @pyqtSlot()
     def run(self):
@@ -136,6 +164,7 @@ class Worker(QRunnable):
         '''
 
         # Retrieve args/kwargs here; and fire processing using them
+        self.signals.started.emit()
         try:
             result = self.func(self.args[0], self.args[1], **self.kwargs)
         except:
@@ -160,6 +189,12 @@ class Main(QMainWindow, FORM_CLASS):
         self.scene = QGraphicsScene()
         self.threadpool = QThreadPool()
         self.threadpool.setMaxThreadCount(MAX_THREADS)
+
+        # exiftool processes and metadata cache shared by all jobs, started with the first job
+        self.et = None
+        self.cache = None
+        self.results = dict()
+        self.tokens = dict()
         self.Handel_Buttons()
 
     def Handel_Buttons(self):
@@ -170,7 +205,14 @@ class Main(QMainWindow, FORM_CLASS):
         self.graphics.setScene(self.scene)
         self.button_box.accepted.connect(self.onAccept)
         self.button_box.rejected.connect(self.onClosePlugin)
+        self.jobs.foldersDropped.connect(self.onFoldersDropped)
+        self.jobs.cellDoubleClicked.connect(self.onJobSelected)
+        self.jobs.pauseRequested.connect(self.onJobPause)
+        self.jobs.resumeRequested.connect(self.onJobResume)
+        self.jobs.cancelRequested.connect(self.onJobCancel)
         self.clearlog.clicked.connect(self.onClearlog)
+        self.statslog.toggled.connect(self.stats.setVisible)
+        self.stats.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
         self.copylog.clicked.connect(self.onCopylog)
         self.savelog.clicked.connect(self.onSavelog)
         self.clearlog.setIcon(QIcon(join(resource_path('icon'), 'erase.png')))
@@ -215,19 +257,99 @@ class Main(QMainWindow, FORM_CLASS):
 
         """
 
-        if self.folder_name is not None:
-            worker = Worker(headingCalculator, self.folder_name, (".jpg"))
-            worker.signals.result.connect(self.writeLog)
-            worker.signals.progress.connect(self.onProgressUpdate)
-            worker.signals.error.connect(self.error)
-            self.threadpool.start(worker)
+        if self.folder_name:
+            self.addJob(self.folder_name)
+
+    def onFoldersDropped(self, folders):
+        """
+        Queue a job for each folder dropped on the job table.
+
+        Parameters
+        ----------
+        folders : list
+            Full paths of the dropped folders.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for folder in folders:
+            self.addJob(folder)
+
+    def addJob(self, folder):
+        """
+        Queue heading calculation of a folder on the thread pool.
+
+        Parameters
+        ----------
+        folder : string
+            Full path to the folder containing photos.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        row = self.jobs.addJob(folder)
+        self.tokens[row] = CancelToken()
+        try:
+            self.startShared()
+        except Exception:
+            # e.g. exiftool missing or not executable: the job fails, later jobs try again
+            self.onJobError(row, sys.exc_info()[:2] + (traceback.format_exc(),))
+            return
+        worker = Worker(headingCalculator, folder, (".jpg",), et=self.et, cache=self.cache, cancel=self.tokens[row],
+                        sidecar=self.sidecar.isChecked(), skip_unchanged=self.skip_unchanged.isChecked(),
+                        processes=self.processes.value(), recursive=self.recursive.isChecked(),
+                        incremental=self.incremental.isChecked())
+        worker.signals.started.connect(partial(self.jobs.setStatus, row, "Running"))
+        worker.signals.result.connect(partial(self.onJobResult, row))
+        worker.signals.progress.connect(partial(self.onProgressUpdate, row))
+        worker.signals.phase.connect(partial(self.onJobPhase, row))
+        worker.signals.error.connect(partial(self.onJobError, row))
+        self.threadpool.start(worker)
+
+    def startShared(self):
+        """
+        Start the exiftool processes and open the metadata cache shared by all jobs.
+
+        Jobs run without cache when it cannot be opened, e.g. when the cache
+        folder is not writable.
+
+        Raises
+        ------
+        Exception
+            exiftool cannot be started.
+
+        Returns
+        -------
+        None.
 
-    def onProgressUpdate(self, n):
         """
-        Update processing progress.
+
+        if self.et is not None:
+            return
+        et = ExifToolPool()
+        et.start()
+        self.et = et
+        try:
+            self.cache = MetadataCache()
+        except Exception as e:
+            self.cache = None
+            self.log.appendPlainText("{0}: Metadata cache disabled: {1}\n".format(
+                QDateTime.currentDateTime().toString(Qt.ISODate), e))
+
+    def onProgressUpdate(self, row, n):
+        """
+        Update processing progress of a job and of the whole queue.
 
         Parameters
         ----------
+        row : int
+            Row of the job in the job table.
         n : float
             Percentage of work done.
 
@@ -237,7 +359,138 @@ class Main(QMainWindow, FORM_CLASS):
 
         """
 
-        self.progress.setValue(int(n))
+        self.jobs.setProgress(row, n)
+        total = sum(self.jobs.progress(r) for r in range(self.jobs.rowCount()))
+        self.progress.setValue(int(total / self.jobs.rowCount()))
+
+    def onJobResult(self, row, result):
+        """
+        Keep the result of a finished job and show it.
+
+        Parameters
+        ----------
+        row : int
+            Row of the job in the job table.
+        result : dict
+            Result of headingCalculator.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.results[row] = result
+        status = "Done: {0} photos".format(len(result["heading"]))
+        if result["failed"]:
+            status += ", {0} not written".format(len(result["failed"]))
+        if result["untimed"]:
+            status += ", {0} without taken time".format(len(result["untimed"]))
+        self.jobs.setStatus(row, status)
+        self.onProgressUpdate(row, 100)
+        self.writeLog(result)
+
+    def onJobError(self, row, e):
+        """
+        Mark a job as failed and log its exception.
+
+        Parameters
+        ----------
+        row : int
+            Row of the job in the job table.
+        e : tuple
+            (exctype, value, traceback.format_exc()) of the exception.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if issubclass(e[0], JobCancelled):
+            self.jobs.setStatus(row, "Cancelled")
+            self.onProgressUpdate(row, 100)
+            return
+        self.jobs.setStatus(row, "Failed")
+        self.jobs.item(row, self.jobs.STATUS).setToolTip(str(e[1]))
+        self.onProgressUpdate(row, 100)
+        self.error(e)
+
+    def onJobPhase(self, row, name):
+        """
+        Show the phase a running job entered.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if not self.tokens[row].paused and not self.tokens[row].cancelled:
+            self.jobs.setStatus(row, "Running: {0}".format(name))
+
+    def onJobPause(self, row):
+        """
+        Hold a job at its next checkpoint.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if row not in self.results and not self.tokens[row].cancelled:
+            self.tokens[row].pause()
+            self.jobs.setStatus(row, "Paused")
+
+    def onJobResume(self, row):
+        """
+        Let a paused job continue.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.tokens[row].paused:
+            self.tokens[row].resume()
+            self.jobs.setStatus(row, "Running")
+
+    def onJobCancel(self, row):
+        """
+        Stop a queued or running job at its next checkpoint.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if row not in self.results:
+            self.tokens[row].cancel()
+            self.jobs.setStatus(row, "Cancelling")
+
+    def onJobSelected(self, row, column):
+        """
+        Display the footprint of a finished job.
+
+        Parameters
+        ----------
+        row : int
+            Row of the job in the job table.
+        column : int
+            Column that was double-clicked.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if row in self.results:
+            result = self.results[row]
+            self.display(result["heading"], float(result["avgdist"]), result.get("segments"))
 
     def error(self, e):
         """
@@ -271,10 +524,14 @@ class Main(QMainWindow, FORM_CLASS):
 
         """
 
-        self.display(result["heading"], float(result["avgdist"]))
+        self.display(result["heading"], float(result["avgdist"]), result.get("segments"))
         self.log.appendPlainText("{0}: Task completed!\n {1}\n".format(QDateTime.currentDateTime().toString(Qt.ISODate), result["msg"]))
+        if result.get("profile"):
+            self.log.appendPlainText("Profile written to {0}\n".format(", ".join(result["profile"])))
+        if result.get("stats"):
+            self.stats.appendPlainText("{0}\n{1}\n".format(QDateTime.currentDateTime().toString(Qt.ISODate), formatStats(result["stats"])))
 
-    def display(self, files, avgdist):
+    def display(self, files, avgdist, segments=None):
         """
         Display footprint of photos.
 
@@ -282,6 +539,11 @@ class Main(QMainWindow, FORM_CLASS):
         ----------
         files : 2D list
              Contains photo name, heading, Latitude, Longitude for each photo.
+        avgdist : float
+             Average distance between photos.
+        segments : list, optional
+             (start, end) rows of files of each flight, drawn as separate
+             tracks. The default is None, which draws one track.
 
         Returns
         -------
@@ -291,22 +553,30 @@ class Main(QMainWindow, FORM_CLASS):
         multC = 40/avgdist
         try:
             self.scene.clear()
+            if not segments:
+                segments = [(0, len(files))]
 
             init_X_GPS, init_Y_GPS = float(files[0][2]), float(files[0][3])
-            init_X, init_Y = 0, 0
-            for f in files:
-                this_X_GPS, this_Y_GPS = float(f[2]), float(f[3])
-
-                pos_X = init_X + multC*(this_X_GPS-init_X_GPS)
-                pos_Y = init_Y - multC*(this_Y_GPS-init_Y_GPS)
-
-                rect_item = QGraphicsArrowItem()
-                rect_item.setRotation(float(f[1]) - 90)
-                rect_item.setPos(pos_X, pos_Y)
-                self.scene.addItem(rect_item)
-
-                init_X_GPS, init_Y_GPS = this_X_GPS, this_Y_GPS
-                init_X, init_Y = pos_X, pos_Y
+            for k, (start, end) in enumerate(segments):
+                color = TRACK_COLORS[k % len(TRACK_COLORS)]
+                track = QPainterPath()
+                for f in files[start:end]:
+                    pos_X = multC*(float(f[2])-init_X_GPS)
+                    pos_Y = -multC*(float(f[3])-init_Y_GPS)
+
+                    rect_item = QGraphicsArrowItem(color=color)
+                    rect_item.setRotation(float(f[1]) - 90)
+                    rect_item.setPos(pos_X, pos_Y)
+                    self.scene.addItem(rect_item)
+
+                    if track.elementCount():
+                        track.lineTo(pos_X, pos_Y)
+                    else:
+                        track.moveTo(pos_X, pos_Y)
+
+                # line through the photos of the flight, under the arrows
+                line = self.scene.addPath(track, QPen(QColor(color), 1, Qt.DashLine))
+                line.setZValue(-1)
 
             self.scene.setSceneRect(self.scene.itemsBoundingRect())
 
@@ -324,6 +594,7 @@ class Main(QMainWindow, FORM_CLASS):
         """
 
         self.log.clear()
+        self.stats.clear()
 
     def onCopylog(self):
         """
@@ -367,6 +638,28 @@ class Main(QMainWindow, FORM_CLASS):
 
         self.close()
 
+    def closeEvent(self, event):
+        """
+        Cancel all jobs, wait for them to stop and stop the shared exiftool processes.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.threadpool.clear()
+        for token in self.tokens.values():
+            token.cancel()
+        self.threadpool.waitForDone()
+        if self.et is not None:
+            self.et.terminate()
+            self.et = None
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        super(Main, self).closeEvent(event)
+
 def main():
     app = QApplication(sys.argv)
     window = Main()
@@ -374,4 +667,6 @@ def main():
     app.exec_()
 
 if __name__=='__main__':
+    # header parsing worker processes start from the frozen executable
+    multiprocessing.freeze_support()
     main()
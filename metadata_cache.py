@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+import sqlite3
+import json
+import hashlib
+from collections import OrderedDict
+from os import environ, makedirs, stat
+from os.path import join, expanduser, dirname
+from threading import Lock
+from time import time
+
+from process_metadata import normalize_path
+
+
+# number of bytes hashed at the start of a photo in fingerprint mode
+FINGERPRINT_BYTES = 64 * 1024
+
+# default number of records kept before the least recently used are evicted
+MAX_ENTRIES = 500000
+
+# number of photos whose fingerprint is remembered, to move their records
+# once this tool wrote to them
+KNOWN_ENTRIES = 100000
+
+
+def default_cache_path():
+    """
+    Location of the metadata cache shared by all folders.
+
+    Returns
+    -------
+    string
+        %LOCALAPPDATA%/heading_calculator on Windows, else $XDG_CACHE_HOME
+        (or ~/.cache)/heading_calculator, with file name metadata.sqlite.
+
+    """
+
+    base = environ.get('LOCALAPPDATA') or environ.get('XDG_CACHE_HOME') or join(expanduser('~'), '.cache')
+    return join(base, 'heading_calculator', 'metadata.sqlite')
+
+
+def fingerprint(path, size):
+    """
+    Fast content fingerprint of a photo: its size and a hash of its header region.
+
+    Parameters
+    ----------
+    path : string
+        Full path to the photo.
+    size : int
+        Size of the photo in bytes.
+
+    Returns
+    -------
+    string
+        Fingerprint that is the same for copies and renames of the photo.
+
+    """
+
+    with open(path, 'rb') as fh:
+        head = fh.read(FINGERPRINT_BYTES)
+    return '{0}:{1}'.format(size, hashlib.sha1(head).hexdigest())
+
+
+def tags_key(tags):
+    """
+    Key of a tag request, so records of different requests are kept apart.
+    """
+
+    return hashlib.sha1('\n'.join(sorted(t.lower() for t in tags)).encode('utf-8')).hexdigest()[:16]
+
+
+class MetadataCache:
+    """
+    Persistent cache of exiftool records.
+
+    Records are stored in SQLite and keyed by photo path, size and
+    modification time (or, in fingerprint mode, by size and a hash of
+    the first 64 KB, so copies and renames of a flight also hit).
+    A record whose photo changed is a miss and is replaced on the next
+    put.  When the cache holds more than max_entries records, the least
+    recently used are evicted.  One instance may be shared by threads.
+    """
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES, use_fingerprint=False):
+
+        self.path = path or default_cache_path()
+        self.max_entries = max_entries
+        self.use_fingerprint = use_fingerprint
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = Lock()
+        # fingerprint mode: photo path -> fingerprint it was last read with
+        self._known = OrderedDict()
+        self._known_lock = Lock()
+
+        if self.path != ':memory:':
+            makedirs(dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS records (
+                key TEXT NOT NULL,
+                tags TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                record TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (key, tags)
+            );
+            CREATE INDEX IF NOT EXISTS records_last_used ON records (last_used);
+        ''')
+        self._db.commit()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        self.close()
+
+    def close(self):
+        """
+        Close the database.
+        """
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _identify(self, photo):
+        """
+        Return (key, size, mtime_ns) of a photo, None if it cannot be read.
+        """
+
+        try:
+            st = stat(photo)
+            if not self.use_fingerprint:
+                return normalize_path(photo), st.st_size, st.st_mtime_ns
+            key = fingerprint(photo, st.st_size)
+        except OSError:
+            return None
+        with self._known_lock:
+            self._known[photo] = key
+            self._known.move_to_end(photo)
+            if len(self._known) > KNOWN_ENTRIES:
+                self._known.popitem(last=False)
+        return key, st.st_size, st.st_mtime_ns
+
+    def get_many(self, photos, tags):
+        """
+        Look up the records of photos.
+
+        Parameters
+        ----------
+        photos : list
+            Full paths to the photos.
+        tags : list
+            Tags requested from exiftool.
+
+        Returns
+        -------
+        list
+            The cached record of each photo, None for a miss.
+
+        """
+
+        tkey = tags_key(tags)
+        ids = [self._identify(p) for p in photos]
+        result = [None] * len(photos)
+        used = list()
+        now = time()
+        with self._lock:
+            for i, (photo, ident) in enumerate(zip(photos, ids)):
+                if ident is None:
+                    continue
+                key, size, mtime_ns = ident
+                row = self._db.execute('SELECT size, mtime_ns, record FROM records WHERE key = ? AND tags = ?',
+                                       (key, tkey)).fetchone()
+                # in fingerprint mode the content decides, the time stamp may differ on copies
+                if row is None or row[0] != size or (not self.use_fingerprint and row[1] != mtime_ns):
+                    continue
+                record = json.loads(row[2])
+                record['SourceFile'] = photo
+                result[i] = record
+                used.append((now, key, tkey))
+            self._db.executemany('UPDATE records SET last_used = ? WHERE key = ? AND tags = ?', used)
+            self._db.commit()
+            self.hits += len(used)
+            self.misses += len(photos) - len(used)
+        return result
+
+    def put_many(self, records, tags):
+        """
+        Store exiftool records, each holding the path of its photo in SourceFile.
+        """
+
+        tkey = tags_key(tags)
+        rows = list()
+        now = time()
+        for record in records:
+            ident = self._identify(record['SourceFile'])
+            if ident is None:
+                continue
+            key, size, mtime_ns = ident
+            rows.append((key, tkey, size, mtime_ns, json.dumps(record), now))
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._evict()
+            self._db.commit()
+
+    def restat(self, photos, tags, changes=None):
+        """
+        Keep the records of photos valid after this tool wrote to them.
+
+        Writing a tag changes the size, modification time and header of a
+        photo, which would turn its record into a miss.  The records are
+        moved to the new identity of the photos instead.
+
+        Parameters
+        ----------
+        photos : list
+            Full paths to the photos that were written.
+        tags : list
+            Tags of the cached records.
+        changes : dict, optional
+            Photo path -> {tag: value} written, merged into the records.
+
+        """
+
+        tkey = tags_key(tags)
+        changes = changes or dict()
+        moves = list()
+        for photo in photos:
+            # the path key does not change; the fingerprint is the one last read
+            if self.use_fingerprint:
+                with self._known_lock:
+                    old = self._known.get(photo)
+            else:
+                old = normalize_path(photo)
+            ident = self._identify(photo)
+            if old is not None and ident is not None:
+                moves.append((photo, old, ident))
+        with self._lock:
+            for photo, old, (key, size, mtime_ns) in moves:
+                row = self._db.execute('SELECT record FROM records WHERE key = ? AND tags = ?',
+                                       (old, tkey)).fetchone()
+                if row is None:
+                    continue
+                record = json.loads(row[0])
+                record.update(changes.get(photo, {}))
+                # copies of the photo share the old fingerprint and keep its record
+                self._db.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)',
+                                 (key, tkey, size, mtime_ns, json.dumps(record), time()))
+            self._db.commit()
+
+    def _evict(self):
+
+        count = self._db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute('DELETE FROM records WHERE rowid IN '
+                             '(SELECT rowid FROM records ORDER BY last_used LIMIT ?)', (excess,))
+            self.evictions += excess
+
+    def invalidate(self, photos):
+        """
+        Drop the records of photos, e.g. after their metadata was rewritten.
+        """
+
+        keys = [ident[0] for ident in map(self._identify, photos) if ident is not None]
+        with self._lock:
+            self._db.executemany('DELETE FROM records WHERE key = ?', [(k,) for k in keys])
+            self._db.commit()
+
+    def clear(self):
+        """
+        Drop all records.
+        """
+
+        with self._lock:
+            self._db.execute('DELETE FROM records')
+            self._db.commit()
+
+    def stats(self):
+        """
+        Counters of this instance and the number of stored records.
+        """
+
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': entries}
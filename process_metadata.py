@@ -22,10 +22,17 @@
  ***************************************************************************/
 """
 
+from os.path import normcase, normpath
+from datetime import datetime
+import numpy as np
+
 from pyexiftool import ExifTool
+from itertools import islice
+from job_control import checked
+import fast_exif
 
 # index of parameters in return value of ProcessMetadata class functions format_tag_path, format_tag_index
-NTAGS = 12 # number of tags
+NTAGS = 13 # number of tags
 IMAGE_WIDTH = 0
 IMAGE_HEIGHT = 1
 FOCAL_LENGTH = 2
@@ -38,10 +45,221 @@ HEADING = 8
 ROLL = 9
 PITCH = 10
 MODEL = 11
+FLIGHT_YAW = 12
+
+# tag, column type and scale of each parameter, in the order of the indices above
+PARAMETERS = [
+    ('file:imagewidth', np.int32, None),
+    ('file:imageheight', np.int32, None),
+    ('exif:focallength', np.float64, 1 / 1000),  # mm to m
+    ('exif:gpslatitude', np.float64, None),
+    ('exif:gpslongitude', np.float64, None),
+    ('exif:gpsaltitude', np.float64, None),
+    ('xmp:relativealtitude', np.float64, None),
+    ('xmp:groundaltitude', np.float64, None),
+    ('xmp:gimbalyawdegree', np.float64, None),
+    ('xmp:gimbalrolldegree', np.float64, None),
+    ('xmp:gimbalpitchdegree', np.float64, None),
+    ('exif:model', object, None),                # categorical
+    ('xmp:flightyawdegree', np.float64, None),   # heading written by a previous run
+]
+
+# photos looked up in the cache, and records stored into it, at once
+READ_BATCH = 1024
+
+
+# normalize photo path for use as key of the metadata index
+def normalize_path(path):
+
+    return normcase(normpath(path))
+
+
+# parse EXIF date and sub-second strings to a POSIX timestamp, NaN if invalid
+def exif_timestamp(value, subsec=None):
+
+    try:
+        date = datetime.strptime(str(value).strip(), '%Y:%m:%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return float('nan')
+    ts = date.timestamp()
+    # sub-second digits are a decimal fraction, e.g. '045' -> 0.045
+    digits = str(subsec).strip() if subsec is not None else ''
+    if digits.isdigit():
+        ts += float('0.' + digits)
+    return ts
+
+
+# 1D object array of values, which may themselves be lists
+def object_array(values):
+
+    arr = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        arr[i] = v
+    return arr
+
+
+class MetadataTable:
+    """
+    Columnar store of photo metadata.
+
+    Every tag is a column with one row per photo.  The parameter tags
+    listed in PARAMETERS are parsed once into typed NumPy arrays with a
+    missing-value mask; the camera model is stored as category codes.
+    Any other tag is kept as an object array of raw values.
+    Columns are accessed by parameter index (e.g. table[LATITUDE]) or
+    by lowercased tag name (e.g. table['exif:gpslatitude']).
+    """
+
+    def __init__(self, columns, nrows):
+
+        self.nrows = nrows
+        self.raw = dict()       # tag -> object array of unparsed values
+        self.values = dict()    # parameter index -> typed array
+        self.mask = dict()      # parameter index -> True where missing
+        self.categories = dict()  # parameter index -> list of category names
+
+        param_index = {p[0]: i for i, p in enumerate(PARAMETERS)}
+        for tag, col in columns.items():
+            if tag in param_index:
+                self._parse(param_index[tag], col)
+            else:
+                self.raw[tag] = object_array(col)
+
+        # parameters never seen are entirely missing
+        for i in range(NTAGS):
+            if i not in self.values:
+                self._parse(i, [None] * nrows)
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Build a table from an iterable of lowercased tag dictionaries.
+
+        Records are consumed one at a time, so the input may be a stream.
+        """
+
+        columns = dict()
+        nrows = 0
+        for d in records:
+            for tag, col in columns.items():
+                col.append(d.pop(tag, None))
+            for tag, v in d.items():
+                columns[tag] = [None] * nrows + [v]
+            nrows += 1
+        return cls(columns, nrows)
+
+    def _parse(self, i, col):
+
+        tag, dtype, scale = PARAMETERS[i]
+        n = len(col)
+
+        if dtype is object:
+            # categorical column: codes into a list of names, -1 if missing
+            categories, codes = dict(), np.full(n, -1, dtype=np.int32)
+            for r, v in enumerate(col):
+                if v is not None and v != '':
+                    codes[r] = categories.setdefault(v, len(categories))
+            self.categories[i] = list(categories)
+            self.values[i] = codes
+            self.mask[i] = codes < 0
+            return
+
+        parsed = np.zeros(n, dtype=np.float64)
+        mask = np.zeros(n, dtype=bool)
+        for r, v in enumerate(col):
+            try:
+                parsed[r] = float(v)
+            except (TypeError, ValueError):
+                mask[r] = True
+        if scale is not None:
+            parsed *= scale
+        if dtype is np.float64:
+            parsed[mask] = np.nan
+        self.values[i] = parsed.astype(dtype)
+        self.mask[i] = mask
+
+    def __len__(self):
+
+        return self.nrows
+
+    def _key(self, key):
+
+        if isinstance(key, str):
+            for i, p in enumerate(PARAMETERS):
+                if p[0] == key:
+                    return i
+        return key
+
+    def __getitem__(self, key):
+        """
+        Column of a parameter index or tag name.
+
+        Missing values are NaN in float columns and 0 in integer
+        columns; the camera model column holds names or None.
+        """
+
+        key = self._key(key)
+        if key in self.categories:
+            names = np.array(self.categories[key] + [None], dtype=object)
+            return names[self.values[key]]
+        if key in self.values:
+            return self.values[key]
+        return self.raw.get(key, object_array([None] * self.nrows))
+
+    def __contains__(self, key):
+
+        key = self._key(key)
+        return key in self.values or key in self.raw
+
+    def missing(self, key):
+        """
+        Boolean mask of the rows where the column has no value.
+        """
+
+        key = self._key(key)
+        if key in self.mask:
+            return self.mask[key]
+        return np.array([v is None for v in self[key]], dtype=bool)
+
+    def value(self, idx, key):
+        """
+        Value of a single cell as a Python object, None if missing.
+        """
+
+        key = self._key(key)
+        if key in self.mask:
+            if self.mask[key][idx]:
+                return None
+            if key in self.categories:
+                return self.categories[key][self.values[key][idx]]
+            return self.values[key][idx].item()
+        return self[key][idx]
+
+    def row(self, idx):
+        """
+        All parameters of a single photo, in the order of the parameter indices.
+        """
+
+        return [self.value(idx, i) for i in range(NTAGS)]
+
+    def take(self, order):
+        """
+        New table holding the rows selected by an index array, in that order.
+        """
+
+        order = np.asarray(order, dtype=np.intp)
+        table = MetadataTable.__new__(MetadataTable)
+        table.nrows = len(order)
+        table.raw = {k: v[order] for k, v in self.raw.items()}
+        table.values = {k: v[order] for k, v in self.values.items()}
+        table.mask = {k: v[order] for k, v in self.mask.items()}
+        table.categories = {k: list(v) for k, v in self.categories.items()}
+        return table
 
 
 class ProcessMetadata:
-    def __init__(self, photos, tags=None):
+    def __init__(self, photos, tags=None, et=None, cache=None, cancel=None, progress=None, fast=True, processes=None,
+                 stats=None):
         
         # if no tags is specified, use the following tags
         if not tags:
@@ -49,32 +267,147 @@ class ProcessMetadata:
                 "exif:gpslongituderef", "exif:gpsaltitude", "exif:model", \
                 "exif:focallength", "file:imagewidth", "file:imageheight", \
                 "xmp:relativealtitude", "xmp:groundaltitude", \
-                "xmp:gimbalyawdegree", "xmp:gimbalrolldegree", "xmp:gimbalpitchdegree"]
-                
-        # get tags
-        metadata = None
-        with ExifTool() as et:
-            metadata = et.get_tags_batch(tags, photos)
-            metadata =  [{k.lower(): v for k, v in d.items()} for d in metadata]
-        
-        self.metadata = metadata
+                "xmp:gimbalyawdegree", "xmp:gimbalrolldegree", "xmp:gimbalpitchdegree", \
+                "exif:datetimeoriginal", "exif:subsectimeoriginal", "xmp:flightyawdegree"]
+        self.tags = tags
+        self.cancel = cancel
+        self.progress = progress
+        self.fast = fast
+        self.processes = processes
+        self.stats = stats
+
+        # photos may be a generator, e.g. a directory walk: they are read
+        # while it is still running
+        if progress is not None:
+            if hasattr(photos, '__len__'):
+                progress.phase('read', len(photos))
+            else:
+                progress.phase('read', 0)
+                photos = progress.counted(photos)
+
+        # get tags, reuse the caller's exiftool (or pool) when given one;
+        # records are stored while exiftool is still writing the reply
+        if et is None:
+            with ExifTool() as et:
+                self.load(self.read_metadata(et, photos, cache))
+        else:
+            self.load(self.read_metadata(et, photos, cache))
+
+    # stream the records of photos: cached records are looked up in batches and
+    # only the misses are read, JPEG headers are parsed in Python when possible
+    # and exiftool reads the other photos; records do not keep the photo order
+    def read_metadata(self, et, photos, cache=None):
+
+        hits = list()
+        misses = photos if cache is None else self.cache_misses(photos, cache, hits)
+        if self.fast:
+            fresh = fast_exif.iter_tags_batch(self.tags, misses, et, self.processes)
+        else:
+            fresh = et.iter_tags_batch(self.tags, misses)
+        if self.cancel is not None or self.progress is not None:
+            fresh = checked(fresh, self.cancel, self.progress)
+
+        read = list()
+        for d in fresh:
+            yield d
+            if cache is not None:
+                read.append(d)
+                if len(read) >= READ_BATCH:
+                    cache.put_many(read, self.tags)
+                    read = list()
+        if read:
+            cache.put_many(read, self.tags)
+        for d in hits:
+            yield d
+
+    # yield the photos missing from the cache, looked up in batches; the cached
+    # records are appended to hits
+    def cache_misses(self, photos, cache, hits):
+
+        it = iter(photos)
+        while True:
+            batch = list(islice(it, READ_BATCH))
+            if not batch:
+                return
+            cached = cache.get_many(batch, self.tags)
+            n_hits = 0
+            for p, r in zip(batch, cached):
+                if r is None:
+                    yield p
+                else:
+                    hits.append(r)
+                    n_hits += 1
+            if self.progress is not None:
+                self.progress.advance(n_hits)
+            if self.stats is not None:
+                self.stats.add('cached', n_hits)
+
+    # build a store from records already extracted, e.g. for testing
+    @classmethod
+    def from_metadata(cls, metadata, tags=None):
+
+        obj = cls.__new__(cls)
+        obj.tags = tags
+        obj.cancel = None
+        obj.progress = None
+        obj.fast = False
+        obj.processes = None
+        obj.stats = None
+        obj.load(metadata)
+        return obj
+
+    # parse lowercased records into a columnar table, indexed by normalized source file
+    def load(self, metadata):
+
+        self.set_table(MetadataTable.from_records({k.lower(): v for k, v in d.items()} for d in metadata))
+
+    # replace the table, e.g. by a reordered one, and rebuild the path index
+    def set_table(self, table):
+
+        self.table = table
+        self.index = {normalize_path(p): i for i, p in enumerate(table['sourcefile']) if p is not None}
+
+    # reorder photos, e.g. by taken time, with an array of indices
+    def sort(self, order):
+
+        self.set_table(self.table.take(order))
+
+    # taken time of all photos as POSIX timestamps, NaN if missing
+    def timestamps(self):
+
+        return np.array([exif_timestamp(d, ss) for d, ss in zip(self.table['exif:datetimeoriginal'], self.table['exif:subsectimeoriginal'])], dtype=np.float64)
+
+    # number of photos in the store
+    def __len__(self):
+
+        return len(self.table)
+
+    # get typed column of a parameter (e.g. LATITUDE) or tag for all photos
+    def column(self, key):
+
+        return self.table[key]
+
+    # get index of a photo in the store, None if it is unknown
+    def path_index(self, path):
+
+        try:
+            return self.index.get(normalize_path(path))
+        except:
+            return None
     
     # get tag value for a single photo, search based on photo path
     def filter_tag_imgpath(self, path, tag):
         
-        try:
-            for d in self.metadata:
-                if d['sourcefile'] == path:
-                    return d[tag]
-            return None
-        except:
+        idx = self.path_index(path)
+        if idx is None:
             return None
+        return self.filter_tag_index(idx, tag)
         
     # get tag value for a single photo, search based on index
     def filter_tag_index(self, idx, tag):
         
         try:
-            return self.metadata[idx][tag]
+            return self.table.value(idx, tag)
         except:
             return None
         
@@ -91,7 +424,7 @@ class ProcessMetadata:
             return False
     
     # format return array
-    def format_return(self, iw, ih, fl, lat, lon, gpsalt, baroalt, groundalt, heading, roll, pitch, model):
+    def format_return(self, iw, ih, fl, lat, lon, gpsalt, baroalt, groundalt, heading, roll, pitch, model, flightyaw=None):
         
         result = [0] * NTAGS
         
@@ -107,117 +440,22 @@ class ProcessMetadata:
         result[ROLL] = roll
         result[PITCH] = pitch
         result[MODEL] = model
+        result[FLIGHT_YAW] = flightyaw
         
         return result
         
     # prepare input data for single uav photo georeference
     def format_tag_path(self, path):
         
-        try:
-            # image width
-            iw = self.filter_tag_imgpath(path, 'file:imagewidth')
-            if iw:
-                iw = int(iw)
-            # image height   
-            ih = self.filter_tag_imgpath(path, 'file:imageheight')
-            if ih:
-                ih = int(ih)
-            # focal length 
-            fl = self.filter_tag_imgpath(path, 'exif:focallength')
-            if fl:
-                fl = float(fl / 1000)
-            # GPS latitude     
-            lat = self.filter_tag_imgpath(path, 'exif:gpslatitude')
-            if lat:
-                lat = float(lat)
-            # GPS longitude        
-            lon = self.filter_tag_imgpath(path, 'exif:gpslongitude')
-            if lon:
-                lon = float(lon)
-            # GPS altitude          
-            gpsalt = self.filter_tag_imgpath(path, 'exif:gpsaltitude')
-            if gpsalt:
-                gpsalt = float(gpsalt)
-            # barometer altitude        
-            baroalt = self.filter_tag_imgpath(path, 'xmp:relativealtitude')
-            if baroalt:
-                baroalt = float(baroalt)
-            # ground altitude        
-            groundalt = self.filter_tag_imgpath(path, 'xmp:groundaltitude')
-            if groundalt:
-                groundalt = float(groundalt)
-            # heading angle      
-            heading = self.filter_tag_imgpath(path, 'xmp:gimbalyawdegree')
-            if heading:
-                heading = float(heading)
-            # roll angle          
-            roll = self.filter_tag_imgpath(path, 'xmp:gimbalrolldegree')
-            if roll:
-                roll = float(roll)
-            # pitch angle     
-            pitch = self.filter_tag_imgpath(path, 'xmp:gimbalpitchdegree')
-            if pitch:
-                pitch = float(pitch)
-            # camera model name
-            model = self.filter_tag_imgpath(path, 'exif:model')
-            
-            return self.format_return(iw, ih, fl, lat, lon, gpsalt, baroalt, groundalt, heading, roll, pitch, model)
-        
-        except:
+        idx = self.path_index(path)
+        if idx is None:
             return None
+        return self.format_tag_index(idx)
         
-    # prepare input data for single uav photo georeference
+    # prepare input data for single uav photo georeference, values are parsed once when loading
     def format_tag_index(self, idx):
         
         try:
-            # image width           
-            iw = self.filter_tag_index(idx, 'file:imagewidth')
-            if iw:
-                iw = int(iw)
-            # image height       
-            ih = self.filter_tag_index(idx, 'file:imageheight')
-            if ih:
-                ih = int(ih)
-            # focal length     
-            fl = self.filter_tag_index(idx, 'exif:focallength')
-            if fl:
-                fl = float(fl / 1000)
-            # GPS latitude         
-            lat = self.filter_tag_index(idx, 'exif:gpslatitude')
-            if lat:
-                lat = float(lat)
-            # GPS longitude         
-            lon = self.filter_tag_index(idx, 'exif:gpslongitude')
-            if lon:
-                lon = float(lon)
-            # GPS altitude           
-            gpsalt = self.filter_tag_index(idx, 'exif:gpsaltitude')
-            if gpsalt:
-                gpsalt = float(gpsalt)
-            # barometer altitude          
-            baroalt = self.filter_tag_index(idx, 'xmp:relativealtitude')
-            if baroalt:
-                baroalt = float(baroalt)
-            # ground altitude         
-            groundalt = self.filter_tag_index(idx, 'xmp:groundaltitude')
-            if groundalt:
-                groundalt = float(groundalt)
-            # heading angle        
-            heading = self.filter_tag_index(idx, 'xmp:gimbalyawdegree')
-            if heading:
-                heading = float(heading)
-            # roll angle          
-            roll = self.filter_tag_index(idx, 'xmp:gimbalrolldegree')
-            if roll:
-                roll = float(roll)
-            # pitch angle      
-            pitch = self.filter_tag_index(idx, 'xmp:gimbalpitchdegree')
-            if pitch:
-                pitch = float(pitch)
-            # camera model name
-            model = self.filter_tag_index(idx, 'exif:model')
-            
-            return self.format_return(iw, ih, fl, lat, lon, gpsalt, baroalt, groundalt, heading, roll, pitch, model)
-        
+            return self.format_return(*self.table.row(idx))
         except:
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+/******************************************************************************************
+ Heading Calculator
+                                 A Standalone Desktop Application
+ This tool estimates heading angle for drone photos.
+                              -------------------
+        begin                : 2020-09-01
+        copyright            : (C) 2019-2021 by Chubu University and
+               National Research Institute for Earth Science and Disaster Resilience (NIED)
+        email                : chuc92man@gmail.com
+ ******************************************************************************************/
+/******************************************************************************************
+ *   This file is part of Heading Calculator.                                             *
+ *                                                                                        *
+ *   This program is free software; you can redistribute it and/or modify                 *
+ *   it under the terms of the GNU General Public License as published by                 *
+ *   the Free Software Foundation, version 3 of the License.                              *
+ *                                                                                        *
+ *   Heading Calculator is distributed in the hope that it will be useful,                *
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or    *
+ *   FITNESS FOR A PARTICULAR PURPOSE.                                                    *
+ *   See the GNU General Public License for more details.                                 *
+ *                                                                                        *
+ *   You should have received a copy of the GNU General Public License along with         *
+ *   Heading Calculator. If not, see <http://www.gnu.org/licenses/>.                      *
+ ******************************************************************************************/
+"""
+
+import cProfile
+import tracemalloc
+from datetime import datetime
+from functools import wraps
+from os import makedirs
+from os.path import basename, join, normpath
+from threading import Lock
+
+
+# number of allocation sites in the memory report
+TOP_ALLOCATIONS = 25
+
+# frames kept per traced allocation, the report groups them by line
+TRACE_FRAMES = 1
+
+# seconds between two checks of the CancelToken of a run waiting for its turn
+LOCK_POLL = 0.2
+
+# cProfile and tracemalloc hold one profiler per process, so profiled runs
+# take turns
+_lock = Lock()
+
+
+def profileName(directory, folder):
+    """
+    Path, without extension, of the profile files of a run on folder.
+
+    Parameters
+    ----------
+    directory : string
+        Directory receiving the profiles, created if needed.
+    folder : string
+        Folder of photos processed by the run.
+
+    Returns
+    -------
+    string
+        directory/<folder name>_<date and time>.
+
+    """
+
+    makedirs(directory, exist_ok=True)
+    name = basename(normpath(str(folder))) or 'photos'
+    return join(directory, "{0}_{1}".format(name, datetime.now().strftime('%Y%m%d_%H%M%S_%f')))
+
+def writeAllocations(snapshot, path, top=TOP_ALLOCATIONS, peak=None):
+    """
+    Write the lines of code holding the most memory in a tracemalloc snapshot.
+
+    Parameters
+    ----------
+    snapshot : tracemalloc.Snapshot
+        Memory allocated at the end of the run.
+    path : string
+        Output text file.
+    top : int, optional
+        Number of lines of code listed. The default is TOP_ALLOCATIONS.
+    peak : int, optional
+        Peak traced memory of the run, in bytes.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    stats = snapshot.statistics('lineno')
+    with open(path, 'w') as f:
+        if peak is not None:
+            f.write("peak traced memory: {0:.1f} KiB\n".format(peak / 1024))
+        f.write("memory held at the end of the run: {0:.1f} KiB\n\n".format(
+            sum(s.size for s in stats) / 1024))
+        for i, s in enumerate(stats[:top], 1):
+            frame = s.traceback[0]
+            f.write("#{0}: {1}:{2}: {3:.1f} KiB in {4} blocks\n".format(
+                i, frame.filename, frame.lineno, s.size / 1024, s.count))
+
+def profiled(func, directory, memory=False, top=TOP_ALLOCATIONS):
+    """
+    Wrap headingCalculator (or a function with the same arguments) to profile each call.
+
+    Each call runs under cProfile and writes <name>.prof (see profileName),
+    to be read with pstats or snakeviz.  With memory, allocations are also
+    traced with tracemalloc and the lines of code holding the most memory
+    are written to <name>.alloc.txt.  The paths are added to the result
+    as 'profile'.  Only the calling thread is profiled: not the worker
+    processes parsing photo headers, nor exiftool.
+
+    Profiled runs take turns.  A run waiting for its turn still stops
+    on the CancelToken passed to it as cancel, and holds while it is
+    paused.  Callers only wrap the function when profiling is switched
+    on, so unprofiled runs call it directly.
+
+    Parameters
+    ----------
+    func : function
+        Function taking the folder of photos as first argument and
+        returning a dict.
+    directory : string
+        Directory receiving the profiles.
+    memory : bool, optional
+        Also trace memory allocations. The default is False.
+    top : int, optional
+        Number of lines of code in the allocation report. The default is TOP_ALLOCATIONS.
+
+    Returns
+    -------
+    function
+        The wrapped function.
+
+    """
+
+    @wraps(func)
+    def wrapper(folder, *args, **kwargs):
+
+        cancel = kwargs.get('cancel')
+        while not _lock.acquire(timeout=LOCK_POLL):
+            if cancel is not None:
+                cancel.check()
+        try:
+            name = profileName(directory, folder)
+            paths = [name + '.prof']
+            profile = cProfile.Profile()
+            if memory:
+                tracemalloc.start(TRACE_FRAMES)
+            try:
+                result = profile.runcall(func, folder, *args, **kwargs)
+            finally:
+                if memory:
+                    # the profiler's own records are not part of the run
+                    snapshot = tracemalloc.take_snapshot().filter_traces(
+                        [tracemalloc.Filter(False, tracemalloc.__file__),
+                         tracemalloc.Filter(False, cProfile.__file__)])
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    paths.append(name + '.alloc.txt')
+                    writeAllocations(snapshot, paths[1], top, peak)
+                profile.dump_stats(paths[0])
+            if isinstance(result, dict):
+                result['profile'] = paths
+            return result
+        finally:
+            _lock.release()
+
+    return wrapper
@@ -77,9 +77,15 @@ import subprocess
 import json
 import warnings
 import codecs
+import asyncio
 from sys import platform
-from os import devnull, read
-from os.path import join, abspath
+from os import devnull, cpu_count
+from contextlib import contextmanager
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Event, Thread
+from os.path import join, abspath, exists, splitext
 
 
 try:        # Py3k compatibility
@@ -133,8 +139,28 @@ sentinel = b"{ready}"
 
 # The block size when reading from exiftool.  The standard value
 # should be fine, though other values might give better performance in
-# some cases.
+# some cases.  The reader doubles the block size, up to
+# ``max_block_size``, whenever a read fills the whole block, so large
+# replies are fetched with few system calls.
 block_size = 4096
+max_block_size = 1 << 20
+
+# Upper bound of the default number of processes in an ExifToolPool,
+# and the smallest number of files worth sending to a separate process.
+max_pool_size = 8
+min_chunk_size = 32
+
+# Number of per-file write commands in a chunk.  The commands are
+# written by a feeder thread while the replies are read, so the size of
+# the pipe buffers does not matter (about 4 KB on Windows); a closed
+# write stops after the chunk being written, and the pool spreads the
+# chunks over its processes.
+write_chunk_size = 256
+
+# Reply buffers larger than this are released once the reply has been
+# consumed, so a single huge reply does not pin its memory for the
+# lifetime of the process.
+max_idle_buffer_size = 1 << 22
 
 # This code has been adapted from Lib/os.py in the Python source tree
 # (sha1 265e36e277f3)
@@ -165,11 +191,344 @@ def _fscodec():
 fsencode = _fscodec()
 del _fscodec
 
+_whitespace = b" \t\r\n"
+
+class _ReplyReader(object):
+    """Read sentinel-terminated replies from the ``exiftool`` output pipe.
+    Output is read straight into a preallocated ``bytearray`` through a
+    ``memoryview``, and only the newly read bytes are scanned for the
+    end-of-output sentinel, so reading a reply is linear in its size.
+    Bytes that follow a sentinel are kept for the next reply, which
+    allows several commands to be in flight at once.
+    """
+
+    def __init__(self, stream, block_size_=None, max_block_size_=None):
+        # read through the unbuffered raw file, one system call per block
+        self._raw = getattr(stream, "raw", stream)
+        self.block_size = block_size_ or block_size
+        self.max_block_size = max(max_block_size_ or max_block_size,
+                                  self.block_size)
+        self._initial_size = max(self.block_size * 16, 1 << 16)
+        self._buffer = bytearray(self._initial_size)
+        self._start = 0     # first byte not yet returned
+        self._end = 0       # end of the valid data
+        self._scanned = 0   # data before this offset holds no sentinel
+        self.bytes_read = 0
+
+    def _reserve(self, size):
+        """Make room for ``size`` more bytes after the valid data."""
+        if len(self._buffer) - self._end >= size:
+            return
+        pending = self._end - self._start
+        if self._start and len(self._buffer) - pending >= size:
+            # move the unread tail to the front instead of growing
+            self._buffer[:pending] = self._buffer[self._start:self._end]
+        else:
+            capacity = len(self._buffer)
+            while capacity - pending < size:
+                capacity *= 2
+            grown = bytearray(capacity)
+            grown[:pending] = self._buffer[self._start:self._end]
+            self._buffer = grown
+        self._scanned = max(0, self._scanned - self._start)
+        self._start, self._end = 0, pending
+
+    def _fill(self):
+        """Read one block from the pipe, return the number of bytes read."""
+        size = self.block_size
+        self._reserve(size)
+        with memoryview(self._buffer) as view:
+            with view[self._end:self._end + size] as target:
+                n = self._raw.readinto(target)
+        self._commit(n, size)
+        return n
+
+    def feed(self, data):
+        """Append ``data`` read from the pipe by the caller.
+        This is used by readers that do their own I/O, such as
+        :py:class:`AsyncExifTool`.
+        """
+        self._reserve(len(data))
+        self._buffer[self._end:self._end + len(data)] = data
+        self._commit(len(data), self.block_size)
+
+    def _commit(self, n, size):
+        if not n:
+            raise IOError("exiftool closed its output before replying.")
+        self._end += n
+        self.bytes_read += n
+        # adapt the block size to the volume of output
+        if n >= size and size < self.max_block_size:
+            self.block_size = min(size * 2, self.max_block_size)
+
+    def _find(self, sentinel_):
+        """Return the sentinel span ``(begin, end)`` or None.
+        ``end`` includes the line break written after the sentinel.
+        """
+        buf = self._buffer
+        pos = buf.find(sentinel_, max(self._start, self._scanned), self._end)
+        while pos >= 0:
+            after = pos + len(sentinel_)
+            if after >= self._end:
+                # the line break has not arrived yet, rescan from here
+                self._scanned = pos
+                return None
+            if buf[after] in b"\r\n":
+                if buf[after] == 13 and after + 1 < self._end \
+                        and buf[after + 1] == 10:
+                    after += 1
+                return pos, after + 1
+            pos = buf.find(sentinel_, pos + 1, self._end)
+        # keep an overlap in case the sentinel straddles two blocks
+        self._scanned = max(self._start, self._end - len(sentinel_) + 1)
+        return None
+
+    def read_reply(self, sentinel_=sentinel):
+        """Block until a complete reply is available and return it.
+        The reply is returned as ``bytes`` with surrounding whitespace
+        and the sentinel removed.
+        """
+        reply = self.pop_reply(sentinel_)
+        while reply is None:
+            self._fill()
+            reply = self.pop_reply(sentinel_)
+        return reply
+
+    def pop_reply(self, sentinel_=sentinel):
+        """Return the next complete reply, or None if it is incomplete."""
+        span = self._find(sentinel_)
+        if span is None:
+            return None
+        begin, after = span
+
+        # strip whitespace without copying the reply twice
+        buf, lo, hi = self._buffer, self._start, begin
+        while lo < hi and buf[lo] in _whitespace:
+            lo += 1
+        while hi > lo and buf[hi - 1] in _whitespace:
+            hi -= 1
+        with memoryview(buf) as view:
+            reply = view[lo:hi].tobytes()
+
+        self._consume(after)
+        return reply
+
+    def _consume(self, after):
+        """Drop the data before offset ``after``."""
+        self._start = self._scanned = after
+        if self._start == self._end:
+            self._start = self._end = self._scanned = 0
+            if len(self._buffer) > max_idle_buffer_size:
+                self._buffer = bytearray(self._initial_size)
+
+    def iter_objects(self, sentinel_=sentinel):
+        """Yield the objects of a JSON reply as soon as each is complete.
+        ``exiftool -j`` writes one object per file and closes each of
+        them with a ``}`` at the start of a line; nested structures are
+        indented and string values never contain raw line breaks.  Each
+        object is yielded as raw ``bytes`` and dropped from the buffer,
+        so only the object being received is held in memory.
+        """
+        scan = self._start
+        while True:
+            span = self._find(sentinel_)
+            limit = self._end if span is None else span[0]
+            pos = self._buffer.find(b"\n}", scan, limit)
+            while pos >= 0:
+                begin = self._buffer.find(b"{", self._start, pos)
+                with memoryview(self._buffer) as view:
+                    obj = view[begin:pos + 2].tobytes()
+                self._start = scan = pos + 2
+                yield obj
+                pos = self._buffer.find(b"\n}", scan, limit)
+            if span is not None:
+                break
+            # keep the scan position across a compaction of the buffer
+            rescan = max(limit - 1, self._start) - self._start
+            self._fill()
+            scan = self._start + rescan
+
+        # anything left but the closing bracket is not in the expected
+        # layout, so parse it as a whole
+        with memoryview(self._buffer) as view:
+            rest = view[self._start:span[0]].tobytes().strip()
+        self._consume(span[1])
+        if rest not in (b"", b"]"):
+            for d in json.loads(rest.lstrip(b",").decode("utf-8")):
+                yield json.dumps(d).encode("utf-8")
+
+def _check_batch_args(tags, filenames):
+    # Explicitly ruling out strings here because passing in a
+    # string would lead to strange and hard-to-find errors
+    if isinstance(tags, basestring):
+        raise TypeError("The argument 'tags' must be "
+                        "an iterable of strings")
+    if isinstance(filenames, basestring):
+        raise TypeError("The argument 'filenames' must be "
+                        "an iterable of strings")
+
+def _tags_params(tags, filenames):
+    """Build the parameters of a tag extraction command."""
+    _check_batch_args(tags, filenames)
+    params = ["-" + t for t in tags]
+    params.extend(filenames)
+    return params
+
+def _chunk_bounds(n_items, n_chunks):
+    """Return the bounds of ``n_chunks`` contiguous, even chunks."""
+    return [n_items * i // n_chunks for i in range(n_chunks + 1)]
+
+def _chunks(values, chunk_size=None):
+    """Yield lists of ``chunk_size`` (default ``write_chunk_size``) items."""
+    it = iter(values)
+    while True:
+        chunk = list(islice(it, chunk_size or write_chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def sidecar_path(filename):
+    """Return the XMP sidecar of a file, ``%d%f.xmp`` in exiftool terms."""
+    return splitext(filename)[0] + ".xmp"
+
+def _write_command(assign, filename, sidecar=False):
+    """Return the bytes of the command writing ``assign`` to one file."""
+    if not sidecar:
+        return (b"-overwrite_original_in_place\n" + assign + b"\n"
+                + fsencode(filename) + b"\n" + _end_of_command)
+    xmp = fsencode(sidecar_path(filename))
+    if exists(xmp):
+        return (b"-overwrite_original_in_place\n" + assign + b"\n"
+                + xmp + b"\n" + _end_of_command)
+    # without a source file, -o creates an XMP file holding only the
+    # tags assigned on the command line
+    return b"-o\n" + xmp + b"\n" + assign + b"\n" + _end_of_command
+
+def _write_chunks(tag, values, chunk_size=None, sidecar=False):
+    """Split ``(filename, value)`` pairs into chunks of write commands.
+    Yield each chunk as the list of its files and the bytes of its
+    commands, one ``-TAG=VALUE`` command per file, or per sidecar.
+    """
+    if not isinstance(tag, basestring):
+        raise TypeError("The argument 'tag' must be a string")
+    assign = fsencode("-{0}=".format(tag))
+    for chunk in _chunks(values, chunk_size):
+        commands = b"".join(_write_command(assign + fsencode(str(v)), f, sidecar)
+                            for f, v in chunk)
+        yield [f for f, v in chunk], commands
+
+# Every command ends by echoing the sentinel to stderr once it has been
+# processed, which frames the errors and warnings of each command.
+_end_of_command = b"-echo4\n" + sentinel + b"\n-execute\n"
+
+# summary lines of an update command, and the count each one adds to
+_update_summary = ((b"image files updated", 0), (b"image files created", 0),
+                   (b"image files unchanged", 1),
+                   (b"files weren't updated due to errors", 2),
+                   (b"files weren't created due to errors", 2))
+
+def update_counts(reply):
+    """Parse the summary of an update command.
+    Return the numbers of files updated (or created), unchanged and not
+    updated because of errors, as reported by ``exiftool``.
+    """
+    counts = [0, 0, 0]
+    for line in reply.splitlines():
+        line = line.strip()
+        for summary, i in _update_summary:
+            if line.endswith(summary):
+                counts[i] += int(line.split(None, 1)[0])
+    return tuple(counts)
+
+def _write_status(reply, errors):
+    """Return the status and message of a single-file write command."""
+    updated, unchanged, failed = update_counts(reply)
+    message = errors.decode("utf-8", "replace").strip() or None
+    if failed or not (updated or unchanged):
+        return "failed", message or reply.decode("utf-8", "replace").strip()
+    return ("updated" if updated else "unchanged"), message
+
+def _drain_errors(reader, replies):
+    """Move the stderr reply of each command to the queue ``replies``.
+    Runs on a thread for the lifetime of the process, so warnings never
+    fill the pipe and block ``exiftool``.  None marks the end of output.
+    """
+    try:
+        while True:
+            replies.put(reader.read_reply())
+    except (IOError, ValueError):
+        replies.put(None)
+
+
+class WriteResult(object):
+    """Outcome of a batch write, file by file.
+    .. py:attribute:: updated
+       List of the files written.
+    .. py:attribute:: unchanged
+       List of the files that already had the value.
+    .. py:attribute:: failed
+       Dictionary mapping each file that could not be written to the
+       error reported by ``exiftool``.
+    .. py:attribute:: warnings
+       Dictionary mapping files written with warnings to the warnings.
+    The files are those passed to the write, unchanged.  A result is
+    true when no file failed.
+    """
+
+    def __init__(self):
+        self.updated = []
+        self.unchanged = []
+        self.failed = {}
+        self.warnings = {}
+
+    def add(self, filename, status, message=None):
+        """Record the status of one file."""
+        self.failed.pop(filename, None)
+        if status == "failed":
+            self.failed[filename] = message
+            return
+        if status == "updated":
+            self.updated.append(filename)
+        else:
+            self.unchanged.append(filename)
+        if message:
+            self.warnings[filename] = message
+
+    def merge(self, other):
+        """Add the files of ``other``, e.g. the result of a retry."""
+        for f in other.updated:
+            self.add(f, "updated", other.warnings.get(f))
+        for f in other.unchanged:
+            self.add(f, "unchanged", other.warnings.get(f))
+        for f, message in other.failed.items():
+            self.failed[f] = message
+        return self
+
+    def retry_values(self, values):
+        """Return the ``(filename, value)`` pairs of the failed files."""
+        return [(f, v) for f, v in values if f in self.failed]
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __bool__(self):
+        return self.ok
+
+    def __len__(self):
+        return len(self.updated) + len(self.unchanged) + len(self.failed)
+
+    def __repr__(self):
+        return "<WriteResult updated={0} unchanged={1} failed={2}>".format(
+            len(self.updated), len(self.unchanged), len(self.failed))
+
 class ExifTool(object):
     """Run the `exiftool` command-line tool and communicate to it.
     You can pass the file name of the ``exiftool`` executable as an
     argument to the constructor.  The default value ``exiftool`` will
-    only work if the executable is in your ``PATH``.
+    only work if the executable is in your ``PATH``.  The optional
+    ``block_size_`` sets the initial size of the blocks read from the
+    process; it grows adaptively for large replies.
     Most methods of this class are only available after calling
     :py:meth:`start()`, which will actually launch the subprocess.  To
     avoid leaving the subprocess running, make sure to call
@@ -192,14 +551,34 @@ class ExifTool(object):
     .. py:attribute:: running
        A Boolean value indicating whether this instance is currently
        associated with a running subprocess.
+    .. py:attribute:: commands
+       Number of commands sent to ``exiftool`` by this instance.
+    .. py:attribute:: bytes_read
+       Number of bytes read from the output pipe of ``exiftool``, over
+       all the processes started by this instance.
     """
 
-    def __init__(self, executable_=None):
+    def __init__(self, executable_=None, block_size_=None):
         if executable_ is None:
             self.executable = executable
         else:
             self.executable = executable_
+        self.block_size = block_size_
         self.running = False
+        self._commands = 0
+        self._bytes_read = 0
+
+    @property
+    def commands(self):
+        return self._commands
+
+    @property
+    def bytes_read(self):
+        # the reader is replaced when the process restarts
+        reader = getattr(self, "_reader", None)
+        if self.running and reader is not None:
+            return self._bytes_read + reader.bytes_read
+        return self._bytes_read
 
     def start(self):
         """Start an ``exiftool`` process in batch mode for this instance.
@@ -212,12 +591,19 @@ class ExifTool(object):
             warnings.warn("ExifTool already running; doing nothing.")
             return
         
-        with open(devnull, "w") as devn:
-            self._process = subprocess.Popen(
-                [self.executable, "-stay_open", "True",  "-@", "-",
-                 "-common_args", "-G", "-n"],
-                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                stderr=devn, startupinfo=startupinfo)
+        self._process = subprocess.Popen(
+            [self.executable, "-stay_open", "True",  "-@", "-",
+             "-common_args", "-G", "-n"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, startupinfo=startupinfo)
+        self._reader = _ReplyReader(self._process.stdout, self.block_size)
+        self._errors = Queue()
+        self._error_thread = Thread(
+            target=_drain_errors,
+            args=(_ReplyReader(self._process.stderr), self._errors))
+        self._error_thread.daemon = True
+        self._error_thread.start()
+        self.last_errors = b""
         self.running = True
 
     def terminate(self):
@@ -228,10 +614,33 @@ class ExifTool(object):
             return
         self._process.stdin.write(b"-stay_open\nFalse\n")
         self._process.stdin.flush()
-        self._process.communicate()
-        del self._process
+        self._stop()
+
+    def _stop(self):
+        """Wait for the process to exit and release its pipes."""
+        try:
+            self._process.stdin.close()
+        except OSError:
+            # a killed process leaves the unsent commands behind
+            pass
+        self._process.wait()
+        self._error_thread.join()
+        self._process.stdout.close()
+        self._process.stderr.close()
+        self._bytes_read += self._reader.bytes_read
+        del self._process, self._reader, self._errors, self._error_thread
         self.running = False
 
+    def _read_errors(self):
+        """Return the stderr output of the command whose reply was read.
+        It is also kept in :py:attr:`last_errors`.
+        """
+        errors = self._errors.get()
+        if errors is None:
+            raise IOError("exiftool closed its error output.")
+        self.last_errors = errors
+        return errors
+
     def __enter__(self):
         self.start()
         return self
@@ -260,25 +669,25 @@ class ExifTool(object):
         """
         if not self.running:
             raise ValueError("ExifTool instance not running.")
-        self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
+        self._process.stdin.write(b"\n".join(params + (_end_of_command,)))
         self._process.stdin.flush()
-        output = b""
-        fd = self._process.stdout.fileno()
-        while not output[-32:].strip().endswith(sentinel):
-            output += read(fd, block_size)
-        return output.strip()[:-len(sentinel)]
-    
+        self._commands += 1
+        reply = self._reader.read_reply()
+        self._read_errors()
+        return reply
+
     def execute_update(self, *params):
-        """ Execute update tags command, return True or False
+        """ Execute update tags command, return True or False.
+        The reply is read, and False is also returned when ``exiftool``
+        reports files that weren't updated due to errors; the errors are
+        kept in :py:attr:`last_errors`.
         """
         try:
-            if not self.running:
-                raise ValueError("ExifTool instance not running.")
-            self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
-            self._process.stdin.flush()
-            return True
-        except:
+            reply = self.execute(*params)
+        except (ValueError, IOError):
             return False
+        updated, unchanged, failed = update_counts(reply)
+        return not failed
 
     def execute_json(self, *params):
         """Execute the given batch of parameters and parse the JSON output.
@@ -303,6 +712,38 @@ class ExifTool(object):
         params = map(fsencode, params)
         return json.loads(self.execute(b"-j", *params).decode("utf-8"))
 
+    def execute_json_iter(self, *params):
+        """Execute the given batch of parameters and stream the JSON output.
+        This generator is similar to :py:meth:`execute_json()`, but
+        yields the dictionary of each file as soon as ``exiftool`` has
+        written it, without holding the whole reply in memory.
+        If the generator is closed before the reply is exhausted, the
+        rest of the reply cannot be told apart from the output of the
+        next command, so the ``exiftool`` process is restarted.
+        """
+        if not self.running:
+            raise ValueError("ExifTool instance not running.")
+        params = tuple(map(fsencode, params))
+        self._process.stdin.write(b"\n".join((b"-j",) + params + (_end_of_command,)))
+        self._process.stdin.flush()
+        self._commands += 1
+        complete = False
+        try:
+            for obj in self._reader.iter_objects():
+                yield json.loads(obj.decode("utf-8"))
+            self._read_errors()
+            complete = True
+        finally:
+            if not complete:
+                self._restart()
+
+    def _restart(self):
+        """Kill the ``exiftool`` process and start a fresh one."""
+        if self.running:
+            self._process.kill()
+            self._stop()
+        self.start()
+
     def get_metadata_batch(self, filenames):
         """Return all meta-data for the given files.
         The return value will have the format described in the
@@ -325,17 +766,14 @@ class ExifTool(object):
         The format of the return value is the same as for
         :py:meth:`execute_json()`.
         """
-        # Explicitly ruling out strings here because passing in a
-        # string would lead to strange and hard-to-find errors
-        if isinstance(tags, basestring):
-            raise TypeError("The argument 'tags' must be "
-                            "an iterable of strings")
-        if isinstance(filenames, basestring):
-            raise TypeError("The argument 'filenames' must be "
-                            "an iterable of strings")
-        params = ["-" + t for t in tags]
-        params.extend(filenames)
-        return self.execute_json(*params)
+        return self.execute_json(*_tags_params(tags, filenames))
+
+    def iter_tags_batch(self, tags, filenames):
+        """Stream only specified tags for the given files.
+        This is the streaming form of :py:meth:`get_tags_batch()`; see
+        :py:meth:`execute_json_iter()`.
+        """
+        return self.execute_json_iter(*_tags_params(tags, filenames))
 
     def get_tags(self, tags, filename):
         """Return only specified tags for a single file.
@@ -366,15 +804,106 @@ class ExifTool(object):
         """
         return self.get_tag_batch(tag, [filename])[0]
     
-    def write_tag_batch(self, csv, foldername):
-        """Update/Write a single tag from the given files as listed in the CSV file.
-        The first argument is a CSV file.
-        The second argument is folderpath of the files.
+    def iter_write_tag_batch(self, tag, values, chunk_size=None, sidecar=False):
+        """Write a value of a single tag to each of the given files.
+        The first argument is a single tag name, as usual in the format
+        <group>:<tag>.  The second argument is an iterable of
+        ``(filename, value)`` pairs.  Each file gets its own command,
+        so only the listed files are touched, in place.  With
+        ``sidecar``, the files are left alone and the value goes to
+        their XMP sidecar (see :py:func:`sidecar_path`), which is
+        updated if it exists and created with just this tag otherwise;
+        ``tag`` must then be an XMP tag.  The commands
+        are streamed over the pipe in chunks of ``chunk_size`` (default
+        ``write_chunk_size``) by a feeder thread while the replies are
+        read, so ``exiftool`` never waits for the next command and
+        neither pipe fills up.
+        ``(filename, status, message)`` is yielded once each file has
+        been processed: ``status`` is ``"updated"``, ``"unchanged"`` or
+        ``"failed"`` as reported by ``exiftool``, and ``message`` is the
+        error or warnings it printed for the file, or None.  If the
+        generator is closed early, the replies of the chunk already sent
+        are still read so the process stays usable; later chunks are
+        not written.
         """
-        csvparam = "-csv={0}".format(csv)
-        params = ["-config .ExifTool_config", "-overwrite_original_in_place", csvparam, foldername]
-        params = map(fsencode, params)
-        return self.execute_update(b"-j", *params)
+        if not self.running:
+            raise ValueError("ExifTool instance not running.")
+        if not isinstance(tag, basestring):
+            raise TypeError("The argument 'tag' must be a string")
+        sent, stop = Queue(), Event()
+        feeder = Thread(target=self._feed,
+                        args=(_write_chunks(tag, values, chunk_size, sidecar), sent, stop))
+        feeder.daemon = True
+        feeder.start()
+        pending = 0
+        try:
+            while True:
+                files = sent.get()
+                if files is None:
+                    break
+                if isinstance(files, Exception):
+                    raise files
+                pending = len(files)
+                for f in files:
+                    reply = self._reader.read_reply()
+                    errors = self._read_errors()
+                    pending -= 1
+                    yield (f,) + _write_status(reply, errors)
+        except GeneratorExit:
+            # read the replies of the chunks already sent, so the
+            # process stays usable
+            stop.set()
+            while True:
+                for _ in range(pending):
+                    self._reader.read_reply()
+                    self._read_errors()
+                files = sent.get()
+                if files is None:
+                    break
+                pending = 0 if isinstance(files, Exception) else len(files)
+            raise
+        finally:
+            stop.set()
+            feeder.join()
+
+    def _feed(self, chunks, sent, stop):
+        """Write chunks of commands to ``exiftool`` until ``stop`` is set.
+        The files of each chunk are put on the queue ``sent`` before the
+        chunk is written, then None once done; an exception raised while
+        building the commands is put on the queue instead of a chunk.
+        """
+        try:
+            for files, commands in chunks:
+                if stop.is_set():
+                    break
+                sent.put(files)
+                self._commands += len(files)
+                try:
+                    self._process.stdin.write(commands)
+                    self._process.stdin.flush()
+                except (OSError, ValueError):
+                    # exiftool exited; reading its replies reports it
+                    break
+        except Exception as e:
+            sent.put(e)
+        finally:
+            sent.put(None)
+
+    def write_tag_batch(self, tag, values, chunk_size=None, sidecar=False):
+        """Write a value of a single tag to each of the given files.
+        See :py:meth:`iter_write_tag_batch()`.  Return a
+        :py:class:`WriteResult`; if ``exiftool`` stops responding, the
+        files not processed yet are reported as failed.
+        """
+        values = list(values)
+        result = WriteResult()
+        try:
+            for f, status, message in self.iter_write_tag_batch(tag, values, chunk_size, sidecar):
+                result.add(f, status, message)
+        except (ValueError, IOError) as e:
+            for f, v in values[len(result):]:
+                result.add(f, "failed", str(e))
+        return result
     
     # def copy_tags_batch(self, indir, outdir):
         
@@ -382,3 +911,473 @@ class ExifTool(object):
     #     params = ["-TagsFromFile", "-ext JPG", indirparam, outdir]
     #     params = map(fsencode, params)
     #     return self.execute_update(b"-j", *params)
+
+
+
+class ExifToolPool(ExifTool):
+    """Keep several ``exiftool`` processes running and share work among them.
+    The pool offers the same interface as :py:class:`ExifTool`.  Batch
+    reads through :py:meth:`get_tags_batch()` are split into contiguous
+    chunks that run concurrently, one chunk per process, and the
+    results are merged back in input order.  Every other command runs
+    on a single idle process.
+    The pool is thread-safe: each command checks out a process for its
+    own use, so one pool may be shared by several threads;
+    :py:attr:`last_errors` then holds the errors of the command that
+    finished last.
+    ``size`` is the number of processes and defaults to the number of
+    CPUs, capped at ``max_pool_size``.
+    """
+
+    def __init__(self, size=None, executable_=None, block_size_=None):
+        super(ExifToolPool, self).__init__(executable_, block_size_)
+        if size is None:
+            size = min(cpu_count() or 1, max_pool_size)
+        self.size = max(1, int(size))
+
+    def start(self):
+        """Start all ``exiftool`` processes of the pool.
+        The processes load in parallel, so starting a pool costs about
+        as much as starting a single :py:class:`ExifTool`.
+        """
+        if self.running:
+            warnings.warn("ExifToolPool already running; doing nothing.")
+            return
+        self._workers = [ExifTool(self.executable, self.block_size)
+                         for _ in range(self.size)]
+        self._idle = Queue()
+        try:
+            for et in self._workers:
+                et.start()
+                self._idle.put(et)
+        except BaseException:
+            # terminate() only stops a running pool: stop the processes
+            # already started here
+            for et in self._workers:
+                et.terminate()
+            del self._workers, self._idle
+            raise
+        self._executor = ThreadPoolExecutor(max_workers=self.size)
+        self.last_errors = b""
+        self.running = True
+
+    def terminate(self):
+        """Terminate all ``exiftool`` processes of the pool.
+        If the pool isn't running, this method will do nothing.
+        """
+        if not self.running:
+            return
+        self._executor.shutdown(wait=True)
+        for et in self._workers:
+            et.terminate()
+            self._commands += et.commands
+            self._bytes_read += et.bytes_read
+        del self._workers, self._idle, self._executor
+        self.running = False
+
+    @property
+    def commands(self):
+        if self.running:
+            return self._commands + sum(et.commands for et in self._workers)
+        return self._commands
+
+    @property
+    def bytes_read(self):
+        if self.running:
+            return self._bytes_read + sum(et.bytes_read for et in self._workers)
+        return self._bytes_read
+
+    @contextmanager
+    def _checkout(self):
+        """Borrow an idle process for the duration of the block."""
+        if not self.running:
+            raise ValueError("ExifToolPool instance not running.")
+        et = self._idle.get()
+        try:
+            yield et
+        finally:
+            self._idle.put(et)
+
+    def execute(self, *params):
+        """Execute the given batch of parameters on one idle process.
+        See :py:meth:`ExifTool.execute()`.
+        """
+        with self._checkout() as et:
+            try:
+                return et.execute(*params)
+            finally:
+                self.last_errors = et.last_errors
+
+    def execute_update(self, *params):
+        """ Execute update tags command on one idle process, return True or False.
+        See :py:meth:`ExifTool.execute_update()`.
+        """
+        try:
+            with self._checkout() as et:
+                try:
+                    return et.execute_update(*params)
+                finally:
+                    self.last_errors = et.last_errors
+        except ValueError:
+            return False
+
+    def _get_tags_chunk(self, tags, filenames):
+        with self._checkout() as et:
+            return et.get_tags_batch(tags, filenames)
+
+    def _write_chunk(self, tag, values, sidecar):
+        with self._checkout() as et:
+            return list(et.iter_write_tag_batch(tag, values, None, sidecar))
+
+    def iter_write_tag_batch(self, tag, values, chunk_size=None, sidecar=False):
+        """Write a value of a single tag to each of the given files.
+        The chunks of :py:meth:`ExifTool.iter_write_tag_batch()` are
+        spread over the processes of the pool, one chunk in flight per
+        process, and the replies are yielded in the order of
+        ``values``.  If the generator is closed early, the chunks
+        already being written are completed; later chunks are not
+        written.
+        """
+        if not isinstance(tag, basestring):
+            raise TypeError("The argument 'tag' must be a string")
+        if not self.running:
+            raise ValueError("ExifToolPool instance not running.")
+        chunks = _chunks(values, chunk_size)
+        futures = []
+        try:
+            while True:
+                for chunk in islice(chunks, self.size - len(futures)):
+                    futures.append(self._executor.submit(self._write_chunk, tag, chunk, sidecar))
+                if not futures:
+                    return
+                for reply in futures.pop(0).result():
+                    yield reply
+        finally:
+            for future in futures:
+                future.result()
+
+    def get_tags_batch(self, tags, filenames):
+        """Return only specified tags for the given files.
+        The files are split among the processes of the pool and the
+        results are returned in the order of ``filenames``.  See
+        :py:meth:`ExifTool.get_tags_batch()`.
+        """
+        _check_batch_args(tags, filenames)
+        tags, filenames = list(tags), list(filenames)
+        n_chunks = min(self.size, -(-len(filenames) // min_chunk_size))
+        if n_chunks <= 1:
+            return self._get_tags_chunk(tags, filenames)
+
+        # contiguous chunks keep the merged result in input order
+        bounds = _chunk_bounds(len(filenames), n_chunks)
+        futures = [self._executor.submit(self._get_tags_chunk, tags,
+                                         filenames[bounds[i]:bounds[i + 1]])
+                   for i in range(n_chunks)]
+        result = []
+        for future in futures:
+            result.extend(future.result())
+        return result
+
+    def _stream_tags_chunk(self, tags, filenames, out, stop):
+        """Feed the results of a chunk to the queue ``out``.
+        The chunk ends with None, or with the exception that stopped it.
+        """
+        try:
+            with self._checkout() as et:
+                for d in et.iter_tags_batch(tags, filenames):
+                    if stop.is_set():
+                        break
+                    out.put(d)
+            out.put(None)
+        except Exception as e:
+            out.put(e)
+
+    def iter_tags_batch(self, tags, filenames):
+        """Stream only specified tags for the given files.
+        The chunks are extracted concurrently as in
+        :py:meth:`get_tags_batch()` and the dictionaries are yielded in
+        the order of ``filenames`` as soon as they are available.
+        """
+        _check_batch_args(tags, filenames)
+        tags, filenames = list(tags), list(filenames)
+        n_chunks = min(self.size, -(-len(filenames) // min_chunk_size))
+        if n_chunks <= 1:
+            with self._checkout() as et:
+                for d in et.iter_tags_batch(tags, filenames):
+                    yield d
+            return
+
+        bounds = _chunk_bounds(len(filenames), n_chunks)
+        queues = [Queue() for _ in range(n_chunks)]
+        stop = Event()
+        threads = [Thread(target=self._stream_tags_chunk,
+                          args=(tags, filenames[bounds[i]:bounds[i + 1]],
+                                queues[i], stop))
+                   for i in range(n_chunks)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            for q in queues:
+                for d in iter(q.get, None):
+                    if isinstance(d, Exception):
+                        raise d
+                    yield d
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+
+
+
+class AsyncExifTool(object):
+    """Asynchronous counterpart of :py:class:`ExifTool`.
+    The ``exiftool`` process is run with
+    ``asyncio.create_subprocess_exec`` and every command is a
+    coroutine, so waiting for ``exiftool`` never blocks the event loop
+    or an executor thread.  Commands sent concurrently to the same
+    instance are serialized; use :py:class:`AsyncExifToolPool` to run
+    several of them at once.  Cancelling a command kills its process,
+    and the next command starts a new one.
+    A convenient way to make sure that the subprocess is terminated is
+    to use the instance as an asynchronous context manager::
+        async with AsyncExifTool() as et:
+            metadata = await et.get_tags_batch(tags, files)
+    """
+
+    def __init__(self, executable_=None, block_size_=None):
+        if executable_ is None:
+            self.executable = executable
+        else:
+            self.executable = executable_
+        self.block_size = block_size_
+        self.running = False
+
+    async def start(self):
+        """Start an ``exiftool`` process in batch mode for this instance.
+        See :py:meth:`ExifTool.start()`.
+        """
+        if self.running:
+            warnings.warn("AsyncExifTool already running; doing nothing.")
+            return
+        await self._spawn()
+        self.last_errors = b""
+        self._lock = asyncio.Lock()
+        self.running = True
+
+    async def _spawn(self):
+        self._process = await asyncio.create_subprocess_exec(
+            self.executable, "-stay_open", "True",  "-@", "-",
+            "-common_args", "-G", "-n",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, startupinfo=startupinfo)
+        self._reader = _ReplyReader(None, self.block_size)
+        self._error_reader = _ReplyReader(None)
+        self._killed = False
+
+    def _kill(self):
+        """Kill the process after a command was cancelled.
+        Its reply would otherwise be read as the reply of the next
+        command; the next command starts a new process instead.
+        """
+        self._killed = True
+        try:
+            self._process.kill()
+        except ProcessLookupError:
+            pass
+
+    async def _restart(self):
+        """Replace a process killed by :py:meth:`_kill`."""
+        if self._killed:
+            await self._process.wait()
+            await self._spawn()
+
+    async def terminate(self):
+        """Terminate the ``exiftool`` process of this instance.
+        If the subprocess isn't running, this method will do nothing.
+        """
+        if not self.running:
+            return
+        async with self._lock:
+            if self._killed:
+                await self._process.wait()
+            else:
+                self._process.stdin.write(b"-stay_open\nFalse\n")
+                await self._process.stdin.drain()
+                await self._process.communicate()
+        del self._process, self._reader, self._error_reader, self._lock
+        self.running = False
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.terminate()
+
+    async def execute(self, *params):
+        """Execute the given batch of parameters with ``exiftool``.
+        See :py:meth:`ExifTool.execute()`.
+        """
+        if not self.running:
+            raise ValueError("AsyncExifTool instance not running.")
+        async with self._lock:
+            await self._restart()
+            self._process.stdin.write(b"\n".join(params + (_end_of_command,)))
+            try:
+                await self._process.stdin.drain()
+                reply, self.last_errors = await self._read_reply()
+            except asyncio.CancelledError:
+                self._kill()
+                raise
+            return reply
+
+    async def _read_reply(self):
+        """Wait for the next complete reply and its stderr output.
+        Both pipes are read at once, so neither can fill up and block
+        ``exiftool``.
+        """
+        return await asyncio.gather(
+            self._read_stream(self._reader, self._process.stdout),
+            self._read_stream(self._error_reader, self._process.stderr))
+
+    async def _read_replies(self, count):
+        """Wait for the next ``count`` replies and their stderr output."""
+        return [await self._read_reply() for _ in range(count)]
+
+    @staticmethod
+    async def _read_stream(reader, stream):
+        reply = reader.pop_reply()
+        while reply is None:
+            reader.feed(await stream.read(reader.block_size))
+            reply = reader.pop_reply()
+        return reply
+
+    async def execute_json(self, *params):
+        """Execute the given batch of parameters and parse the JSON output.
+        See :py:meth:`ExifTool.execute_json()`.
+        """
+        params = map(fsencode, params)
+        return json.loads((await self.execute(b"-j", *params)).decode("utf-8"))
+
+    async def get_tags_batch(self, tags, filenames):
+        """Return only specified tags for the given files.
+        See :py:meth:`ExifTool.get_tags_batch()`.
+        """
+        return await self.execute_json(*_tags_params(tags, filenames))
+
+    async def write_tag_batch(self, tag, values, chunk_size=None, sidecar=False):
+        """Write a value of a single tag to each of the given files.
+        See :py:meth:`ExifTool.write_tag_batch()`.
+        """
+        values = list(values)
+        result = WriteResult()
+        try:
+            if not self.running:
+                raise ValueError("AsyncExifTool instance not running.")
+            for files, commands in _write_chunks(tag, values, chunk_size, sidecar):
+                async with self._lock:
+                    await self._restart()
+                    # drain while the replies are read, or a chunk larger
+                    # than the pipes would block both ends
+                    self._process.stdin.write(commands)
+                    try:
+                        _, replies = await asyncio.gather(
+                            self._process.stdin.drain(), self._read_replies(len(files)))
+                    except asyncio.CancelledError:
+                        self._kill()
+                        raise
+                    for f, (reply, errors) in zip(files, replies):
+                        result.add(f, *_write_status(reply, errors))
+        except (ValueError, IOError) as e:
+            for f, v in values[len(result):]:
+                result.add(f, "failed", str(e))
+        return result
+
+
+class AsyncExifToolPool(AsyncExifTool):
+    """Keep several asynchronous ``exiftool`` processes running.
+    This is the asynchronous counterpart of :py:class:`ExifToolPool`:
+    batch reads are split into chunks that run concurrently on the
+    processes of the pool, and any number of coroutines may share it.
+    """
+
+    def __init__(self, size=None, executable_=None, block_size_=None):
+        super(AsyncExifToolPool, self).__init__(executable_, block_size_)
+        if size is None:
+            size = min(cpu_count() or 1, max_pool_size)
+        self.size = max(1, int(size))
+
+    async def start(self):
+        """Start all ``exiftool`` processes of the pool."""
+        if self.running:
+            warnings.warn("AsyncExifToolPool already running; doing nothing.")
+            return
+        self._workers = [AsyncExifTool(self.executable, self.block_size)
+                         for _ in range(self.size)]
+        started = await asyncio.gather(*(et.start() for et in self._workers),
+                                       return_exceptions=True)
+        errors = [e for e in started if isinstance(e, BaseException)]
+        if errors:
+            # terminate() only stops a running pool: stop the processes
+            # already started here
+            await asyncio.gather(*(et.terminate() for et in self._workers))
+            del self._workers
+            raise errors[0]
+        self._idle = asyncio.Queue()
+        for et in self._workers:
+            self._idle.put_nowait(et)
+        self.running = True
+
+    async def terminate(self):
+        """Terminate all ``exiftool`` processes of the pool."""
+        if not self.running:
+            return
+        await asyncio.gather(*(et.terminate() for et in self._workers))
+        del self._workers, self._idle
+        self.running = False
+
+    async def _run(self, method, *args):
+        """Run ``method`` of an idle process of the pool."""
+        if not self.running:
+            raise ValueError("AsyncExifToolPool instance not running.")
+        et = await self._idle.get()
+        try:
+            return await getattr(et, method)(*args)
+        finally:
+            self._idle.put_nowait(et)
+
+    async def execute(self, *params):
+        """Execute the given batch of parameters on one idle process."""
+        return await self._run("execute", *params)
+
+    async def write_tag_batch(self, tag, values, chunk_size=None, sidecar=False):
+        """Write a value of a single tag to each of the given files.
+        The chunks are written concurrently on the processes of the
+        pool.  See :py:meth:`ExifTool.write_tag_batch()`.
+        """
+        if not isinstance(tag, basestring):
+            raise TypeError("The argument 'tag' must be a string")
+        chunks = list(_chunks(values, chunk_size))
+        results = await asyncio.gather(*(
+            self._run("write_tag_batch", tag, chunk, None, sidecar) for chunk in chunks))
+        result = WriteResult()
+        for r in results:
+            result.merge(r)
+        return result
+
+    async def get_tags_batch(self, tags, filenames):
+        """Return only specified tags for the given files.
+        The files are split among the processes of the pool and the
+        results are returned in the order of ``filenames``.
+        """
+        _check_batch_args(tags, filenames)
+        tags, filenames = list(tags), list(filenames)
+        n_chunks = min(self.size, -(-len(filenames) // min_chunk_size))
+        if n_chunks <= 1:
+            return await self._run("get_tags_batch", tags, filenames)
+        bounds = _chunk_bounds(len(filenames), n_chunks)
+        chunks = await asyncio.gather(*(
+            self._run("get_tags_batch", tags, filenames[bounds[i]:bounds[i + 1]])
+            for i in range(n_chunks)))
+        return [d for chunk in chunks for d in chunk]